@@ -0,0 +1,1174 @@
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Generic, Callable, List, Optional
+
+import numpy as np
+import sys
+from PIL import Image as PILImage
+from kivy.app import App
+from kivy.base import EventLoop
+from kivy.core.clipboard import Clipboard
+from kivy.core.window import Window
+from kivy.graphics.opengl import GL_MAX_TEXTURE_SIZE, glGetIntegerv
+from kivy.graphics.texture import Texture
+from kivy.graphics.context_instructions import Color
+from kivy.graphics.instructions import InstructionGroup
+from kivy.graphics.vertex_instructions import Line, Rectangle
+from kivy.metrics import dp
+from kivy.properties import ObjectProperty, NumericProperty, BooleanProperty, Clock, partial, StringProperty
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.floatlayout import FloatLayout
+from kivy.uix.image import Image
+from kivy.uix.label import Label
+from kivy.uix.popup import Popup
+from kivy.uix.progressbar import ProgressBar
+from kivy.uix.stacklayout import StackLayout
+from kivy.uix.stencilview import StencilView
+from kivy.uix.widget import Widget
+
+from editor import operations, palette
+from editor.cache import CACHE_DIRECTORY, FrameSet, ResultCache, pixels_fingerprint
+from editor.dedup import DedupIndex
+from editor.prefetch import FramePrefetcher, PreparedFrame, load_preview, needs_preview, preview_factor
+from editor.trace import format_timings, span, traced, tracer
+from editor.watch import FolderWatcher
+
+
+class SpriteEditorApp(App):
+    def __init__(self):
+        super(SpriteEditorApp, self).__init__()
+        self.canvas: 'SpriteEditorWidget' = None
+
+    def build(self):
+        self.canvas = SpriteEditorWidget()
+        self.title = "Sprite Extractor"
+        return self.canvas
+
+    def on_stop(self):
+        self.canvas.prefetcher.shutdown()
+        trace_path = os.environ.get("SPRITEX_TRACE", "")
+        if trace_path.endswith(".json"):
+            tracer.export(trace_path)
+
+
+class SpriteEditorInfoLabel(Label):
+    name = StringProperty()
+    val_format = StringProperty()
+
+    def __init__(self, **kwargs):
+        super(SpriteEditorInfoLabel, self).__init__(**kwargs)
+
+    def set_value(self, value):
+        formatted = self.val_format % value
+        self.markup = True
+        self.text = f"[b]{self.name}:[/b] {formatted}"
+
+
+class SpriteEditorProgress(ProgressBar):
+    def __init__(self, **kwargs):
+        super(SpriteEditorProgress, self).__init__(**kwargs)
+        self.last_update = time.time()
+        target_fps = 60.0
+        self.frame_time = 1.0 / target_fps
+        self.opacity = 0
+
+    def update(self, value):
+        self.value = value
+        if 0.0 < value < 100.0:
+            self.opacity = 1.0
+        else:
+            self.opacity = 0.0
+
+        if time.time() - self.last_update > self.frame_time:
+            EventLoop.idle()
+            self.last_update = time.time()
+
+    def step(self, value):
+        self.update(self.value + value)
+
+    def partial_step(self, done, total, final):
+        step = (done / total) * final
+        self.step(step)
+
+
+class SpriteEditorWidget(Widget):
+    image: PILImage = ObjectProperty(None, allownone=True)
+    image_path: str = StringProperty(None)
+    prefetch_ahead = 4
+    watch_regions = 8
+    max_texture_size: Optional[int] = None
+    button_height = dp(35)
+    label_height = dp(20)
+    progress: SpriteEditorProgress = ObjectProperty(None)
+
+    def show_popup(self, text):
+        popup = Popup(title="Sprite Extractor", content=Label(text=text, markup=True), size_hint=(0.6, 0.3))
+        popup.open()
+
+    def _create_info_label(self, name, val_format="%i"):
+        label = SpriteEditorInfoLabel(halign="left", text_size=(200, dp(32)), size=(200, self.label_height),
+                                      size_hint=(1, None),
+                                      padding=[8, 8])
+        label.name = name
+        label.val_format = val_format
+        self.tool_stack.add_widget(label)
+        return label
+
+    def _create_tool_button(self, name, pressed: Callable):
+        result = Button(text=name, size=(200, self.button_height), size_hint=(1, None))
+        result.bind(on_press=pressed)
+        self.tool_stack.add_widget(result)
+        return result
+
+    def _create_tool_label(self, name):
+        result = Label(halign="left", text_size=(200, dp(32)), size=(200, self.label_height), markup=True,
+                       size_hint=(1, None), padding=[8, 8])
+        result.text = "[b]" + name + "[/b]"
+        self.tool_stack.add_widget(result)
+        return result
+
+    def _toggle_press(self, button, *args):
+        button.sp_toggle = not button.sp_toggle
+        if button.sp_toggle:
+            button.background_color = [0, 1, 0, 1]
+            button.sp_event(button, True)
+        else:
+            button.background_color = [1, 1, 1, 1]
+            button.sp_event(button, False)
+
+    def _create_toggle_button(self, name, pressed: Callable):
+        result = Button(text=name, size=(200, self.button_height), size_hint=(1, None))
+        result.sp_toggle = False
+        result.sp_event = pressed
+        result.bind(on_press=self._toggle_press)
+        self.tool_stack.add_widget(result)
+        return result
+
+    def _create_timings_label(self):
+        result = Label(halign="left", valign="top", text_size=(dp(192), dp(120)), size=(200, dp(120)),
+                       markup=True, size_hint=(1, None), padding=[8, 8])
+        self.tool_stack.add_widget(result)
+        return result
+
+    def _on_trace(self, name, duration, children):
+        if not children:
+            return
+        Clock.schedule_once(partial(self._show_timings, format_timings(name, duration, children)))
+
+    def _show_timings(self, text, *args):
+        self.timings_label.text = text
+
+    def _on_overlay_update(self, *args):
+        if self.overlay_updater is not None:
+            self.overlay_updater()
+
+    def __init__(self, **kwargs):
+        super(SpriteEditorWidget, self).__init__(**kwargs)
+        self.root = BoxLayout(orientation='horizontal')
+        self.add_widget(self.root)
+
+        self.viewer = SpriteEditorViewer(owner=self, size_hint=(.7, 1))
+
+        self.progress = SpriteEditorProgress(max=100, pos_hint={'x': 0, 'y': 0.98}, size=(100, dp(10)),
+                                             size_hint=(1, None))
+        self.viewer.add_widget(self.progress)
+
+        self.viewer.padding = [4, 4]
+        self.root.add_widget(self.viewer)
+
+        tool_stack = StackLayout(size=(dp(200), 50), size_hint=(None, 1))
+        tool_stack.orientation = "tb-lr"
+        tool_stack.padding = [4, 4]
+        tool_stack.spacing = 4
+        self.root.add_widget(tool_stack)
+        self.tool_stack = tool_stack
+
+        self._create_toggle_button('Toggle Grid', self.toggle_grid_press)
+        self.select_button = self._create_tool_button('Select Region', self.select_press)
+
+        self._create_tool_button('Copy Region to Clipboard', self.copy_region_press)
+
+        self._create_tool_label("Extract:")
+        self._create_tool_button('Sprite', self.create_sprite_press)
+        self._create_tool_button('Sprite (All Frames)', self.extract_all_sprites_press)
+        self._create_tool_button('Unique Colors', self.find_unique_press)
+        self._create_tool_button('Unique Sprite', self.highlight_unique_press)
+        self._create_tool_button('Transparent Sprite', self.extract_transparent_press)
+
+        self._create_tool_label("Overlay:")
+        self._create_toggle_button('Unique Colors', self.overlay_unique_press)
+        self._create_toggle_button('Transparent Sprite', self.overlay_transparent_press)
+
+        self.overlay_updater: Optional[Callable] = None
+
+        self._create_tool_label("Frames:")
+        self._create_tool_button('Previous Frame', self.previous_frame_press)
+        self._create_tool_button('Next Frame', self.next_frame_press)
+        self.results = ResultCache(directory=CACHE_DIRECTORY / "results")
+        self._image_fingerprint: Optional[str] = None
+        self.frame: Optional[PreparedFrame] = None
+        self.frame_folder: Optional[Path] = None
+        # Path of the frame on screen, restored when another one can not be loaded.
+        self.shown_path: Optional[Path] = None
+        self.load_error: Optional[Exception] = None
+        self.frame_paths: List[Path] = []
+        self.frame_set: Optional[FrameSet] = None
+        self.prefetcher = FramePrefetcher(size=self.prefetch_ahead * 2)
+        self.prefetcher.listeners.append(self._on_frame_prefetched)
+        self.watch_button = self._create_toggle_button('Watch Folder', self.watch_folder_press)
+        self.watcher: Optional[FolderWatcher] = None
+        self._watch_event = None
+        # Accumulators of the last few selected regions, kept up to date with new frames while watching.
+        self.transparent_accumulators: 'OrderedDict[tuple, operations.TransparentAccumulator]' = OrderedDict()
+        self._create_toggle_button('Indexed Colors', self.indexed_colors_press)
+        self.indexed_colors = False
+
+        self._create_tool_label("Region Info:")
+        self.x_label = self._create_info_label("x")
+        self.y_label = self._create_info_label("y")
+
+        self.sel_x_label = self._create_info_label("sel x")
+        self.sel_y_label = self._create_info_label("sel y")
+        self.sel_width_label = self._create_info_label("sel width")
+        self.sel_height_label = self._create_info_label("sel height")
+
+        self._create_tool_label("Profiling:")
+        tracing_button = self._create_toggle_button('Tracing', self.tracing_press)
+        if tracer.enabled:
+            tracing_button.sp_toggle = True
+            tracing_button.background_color = [0, 1, 0, 1]
+        self._create_tool_button('Export Trace', self.export_trace_press)
+        self.timings_label = self._create_timings_label()
+        tracer.listeners.append(self._on_trace)
+
+        self.viewer.selection.bind(on_update=self._on_overlay_update)
+
+        Window.bind(on_resize=self.on_window_resize)
+        Window.clearcolor = (0.136, 0.191, 0.25, 1)
+        Window.bind(on_dropfile=self._on_drop_file)
+        self.root.size = (Window.width, Window.height)
+
+        if len(sys.argv) > 1:
+            self.load_image(sys.argv[1])
+
+    def _on_drop_file(self, window, file_path):
+        p = file_path.decode("utf-8")
+        print(p)
+        self.load_image(p)
+
+    def copy_region_press(self, *args):
+        region = self.viewer.selection
+        text = f"\"REGION\": ({int(region.sel_y)}, {int(region.sel_x)}, {int(region.sel_y + region.sel_height)}, {int(region.sel_x + region.sel_width)})"
+        Clipboard.copy(text)
+        self.show_popup(f"Copied to clipboard:\n[b]{text}[/b]")
+
+    @staticmethod
+    def date_for_filename():
+        return time.strftime("%Y%m%d%H%M%S", time.localtime())
+
+    @property
+    def is_region_selected(self):
+        return self.viewer.selection.sel_width * self.viewer.selection.sel_height > 0.1
+
+    @traced("overlay transparent sprite")
+    def overlay_update_transparent_extractor(self):
+        if not self.is_region_selected or self.image is None:
+            return
+        extracted = self.extract_transparent_black()
+        self.viewer.selection.overlay = self.pil_to_texture(extracted)
+
+    @traced("overlay unique colors")
+    def overlay_update_highlight_unique(self):
+        if not self.is_region_selected or self.image is None:
+            return
+        extracted = self.highlight_unique()
+        if extracted is None:
+            self.viewer.selection.overlay = None
+        else:
+            self.viewer.selection.overlay = self.pil_to_texture(extracted)
+
+    def overlay_transparent_press(self, button, enabled, *args):
+        if enabled:
+            self.overlay_updater = self.overlay_update_transparent_extractor
+            self.overlay_update_transparent_extractor()
+        else:
+            self.overlay_updater = None
+            self.viewer.selection.overlay = None
+
+    def overlay_unique_press(self, button, enabled, *args):
+        if enabled:
+            self.overlay_updater = self.overlay_update_highlight_unique
+            self.overlay_update_highlight_unique()
+        else:
+            self.overlay_updater = None
+            self.viewer.selection.overlay = None
+
+    def get_transparent_accumulator(self) -> operations.TransparentAccumulator:
+        region = self.get_selection_region()
+        accumulator = self.transparent_accumulators.get(region)
+        if accumulator is not None:
+            self.transparent_accumulators.move_to_end(region)
+            return accumulator
+
+        # Built from the frames the watcher already knows, in the order of list_frames. Newer ones are folded
+        # in by _poll_watcher.
+        frames = sorted(self.watcher.folder / name for name in self.watcher.known)
+        accumulator = operations.TransparentAccumulator(region)
+        self.progress.update(0.1)
+        for frame in frames:
+            self.fold_watched_frame(frame, [accumulator])
+            self.progress.partial_step(1, len(frames), 99)
+        self.progress.update(100)
+        self.transparent_accumulators[region] = accumulator
+        while len(self.transparent_accumulators) > self.watch_regions:
+            self.transparent_accumulators.popitem(last=False)
+        return accumulator
+
+    def fold_watched_frame(self, frame: Path, accumulators: List[operations.TransparentAccumulator]) -> bool:
+        try:
+            image = operations.open_frame(frame)
+        except (OSError, SyntaxError) as e:
+            # Usually a frame that is still being written, it is reported again once it changes.
+            print("Could not read", frame, e)
+            self.watcher.retry(frame)
+            return False
+        for accumulator in accumulators:
+            accumulator.add_image(image)
+        return True
+
+    def indexed_or_rgb(self, indexed: Callable, rgb: Callable):
+        # Both give the same results, indexed color mode makes unique color queries faster for low color images.
+        if self.indexed_colors:
+            try:
+                return indexed()
+            except palette.TooManyColors as e:
+                print(e, "- using RGB")
+        return rgb()
+
+    def get_indexed_frame(self) -> palette.IndexedFrame:
+        if self.frame.indexed is None:
+            self.frame.indexed = palette.index_frame(self.pixels)
+        return self.frame.indexed
+
+    def indexed_colors_press(self, button, enabled, *args):
+        self.indexed_colors = enabled
+
+    @property
+    def pixels(self) -> np.ndarray:
+        return self.frame.pixels
+
+    @property
+    def image_fingerprint(self) -> str:
+        if self._image_fingerprint is None:
+            with span("fingerprint"):
+                self._image_fingerprint = pixels_fingerprint(self.pixels)
+        return self._image_fingerprint
+
+    def extract_transparent_black(self):
+        if self.watcher is not None:
+            return self.get_transparent_accumulator().transparent_black()
+        frames = self.get_frame_paths()
+        region = self.get_selection_region()
+        # Only used for the overlay, which updates on every selection change, so it is not written to disk.
+        return self.results.memoize(self.frame_set.fingerprint, region, "transparent_black",
+                                    lambda: operations.extract_transparent_black(frames, region, self.progress))
+
+    def extract_transparent(self):
+        if self.watcher is not None:
+            return self.get_transparent_accumulator().transparent()
+        frames = self.get_frame_paths()
+        region = self.get_selection_region()
+        return self.results.memoize(self.frame_set.fingerprint, region, "transparent",
+                                    lambda: operations.extract_transparent(frames, region), persist=True)
+
+    def start_watching(self):
+        self.watcher = FolderWatcher(Path(self.image_path).parents[0])
+        self._watch_event = Clock.schedule_interval(self._poll_watcher, 0.25)
+        print("Watching", self.watcher.folder, "using", self.watcher.backend)
+
+    def stop_watching(self):
+        if self.watcher is None:
+            return
+        self._watch_event.cancel()
+        self._watch_event = None
+        self.watcher.close()
+        self.watcher = None
+        self.transparent_accumulators.clear()
+
+    def watch_folder_press(self, button, enabled, *args):
+        if not enabled:
+            self.stop_watching()
+            return
+        if not self.image_path:
+            button.sp_toggle = False
+            button.background_color = [1, 1, 1, 1]
+            self.show_popup("No image loaded")
+            return
+        self.start_watching()
+
+    def _poll_watcher(self, dt):
+        frames = self.watcher.poll()
+        if len(frames) == 0:
+            return
+
+        with span("watch folder", frames=len(frames)):
+            if len(self.transparent_accumulators) > 0:
+                accumulators = list(self.transparent_accumulators.values())
+                frames = [frame for frame in frames if self.fold_watched_frame(frame, accumulators)]
+            self.frame_paths = sorted(set(self.frame_paths).union(frames))
+            if self.frame_set is not None:
+                self.frame_set.invalidate()
+            self.prefetch_neighbours()
+            if self.overlay_updater == self.overlay_update_transparent_extractor:
+                self.overlay_updater()
+
+    def check_region_selected(self):
+        if self.image is None:
+            self.show_popup("Image is still loading")
+            return False
+        if not self.is_region_selected:
+            self.show_popup("No region selected")
+            return False
+        return True
+
+    @traced("extract transparent sprite")
+    def extract_transparent_press(self, *args):
+        if not self.check_region_selected():
+            return
+        self.save_image("../extracted", self.extract_transparent())
+
+    def highlight_unique(self):
+        region = self.get_selection_region()
+        return self.results.memoize(self.image_fingerprint, region, "highlight_unique",
+                                    lambda: self.indexed_or_rgb(
+                                        lambda: palette.highlight_unique(self.get_indexed_frame(), region,
+                                                                         self.progress),
+                                        lambda: operations.highlight_unique(self.pixels, region, self.progress)))
+
+    @traced("extract unique sprite")
+    def highlight_unique_press(self, *args):
+        if not self.check_region_selected():
+            return
+        image = self.highlight_unique()
+        if image is None:
+            self.show_popup("No unique colors found")
+            return
+        self.save_image("highlight", image)
+
+    def get_selection_region(self):
+        region = self.viewer.selection
+
+        selection = (region.sel_x, region.sel_y,
+                     region.sel_x + region.sel_width,
+                     region.sel_y + region.sel_height)
+        return selection
+
+    def get_selection_image(self, custom_image=None) -> PILImage:
+        if custom_image is not None:
+            return operations.crop(custom_image, self.get_selection_region())
+        sprite = operations.crop(self.image, self.get_selection_region())
+        if not self.frame.has_alpha:
+            sprite = sprite.convert("RGB")
+        return sprite
+
+    def find_unique_colors(self) -> List[List[int]]:
+        region = self.get_selection_region()
+        return self.results.memoize(self.image_fingerprint, region, "unique_colors",
+                                    lambda: self.indexed_or_rgb(
+                                        lambda: palette.find_unique_colors(self.get_indexed_frame(), region,
+                                                                           self.progress),
+                                        lambda: operations.find_unique_colors(self.pixels, region, self.progress)))
+
+    def save_image(self, name, image):
+        p = Path(self.image_path)
+        p = p.parents[0] / f"{name}_{self.date_for_filename()}.png"
+        print(p)
+        with span("save"):
+            image.save(p)
+        self.show_popup(f"File written to: [b]{p}[/b]")
+        print("File written to:", p)
+
+    @traced("extract unique colors")
+    def find_unique_press(self, *args):
+        if not self.check_region_selected():
+            return
+        unique_colors = self.find_unique_colors()
+        if len(unique_colors) == 0:
+            self.show_popup("No unique colors found")
+            return
+        unique_colors = np.array([unique_colors])
+        print(unique_colors)
+        print(unique_colors.shape)
+        unique_color_image = PILImage.fromarray(unique_colors.astype('uint8'), "RGB")
+
+        self.save_image("unique", unique_color_image)
+
+    @traced("extract sprite")
+    def create_sprite_press(self, *args):
+        if not self.check_region_selected():
+            return
+        sprite = self.get_selection_image()
+        self.save_image("sprite", sprite)
+
+    def get_frame_paths(self) -> List[Path]:
+        folder = Path(self.image_path).parents[0]
+        if self.frame_set is None or self.frame_set.folder != folder:
+            self.frame_set = FrameSet(folder)
+        return self.frame_set.paths
+
+    def extract_all_sprites(self):
+        folder = Path(self.image_path).parents[0]
+        output = folder.parent / f"{folder.name}_sprites"
+        output.mkdir(exist_ok=True)
+        index_path = output / "dedup.json"
+        index = DedupIndex.load(index_path)
+
+        x1, y1, x2, y2 = (int(v) for v in self.get_selection_region())
+        frames = self.get_frame_paths()
+        written = 0
+        self.progress.update(0.1)
+        for frame in frames:
+            sprite = self.get_selection_image(operations.open_frame(frame))
+            name = f"{frame.stem}_{y1}_{x1}_{y2}_{x2}.png"
+            with span("dedup"):
+                duplicate = index.add(sprite, name)
+            if duplicate is None:
+                with span("save"):
+                    sprite.save(output / name)
+                written += 1
+            self.progress.partial_step(1, len(frames), 99)
+        index.save(index_path)
+        self.progress.update(100)
+        return output, written, len(frames) - written
+
+    @traced("extract all frames")
+    def extract_all_sprites_press(self, *args):
+        if not self.check_region_selected():
+            return
+        output, written, skipped = self.extract_all_sprites()
+        self.show_popup(f"Written [b]{written}[/b] sprites, skipped [b]{skipped}[/b] duplicates to:\n[b]{output}[/b]")
+
+    def toggle_grid_press(self, button, enabled, *args):
+        self.viewer.toggle_grid(enabled)
+
+    def tracing_press(self, button, enabled, *args):
+        tracer.enabled = enabled
+
+    def export_trace_press(self, *args):
+        if self.image_path:
+            p = Path(self.image_path).parents[0] / f"trace_{self.date_for_filename()}.json"
+        else:
+            p = Path.cwd() / f"trace_{self.date_for_filename()}.json"
+        tracer.export(p)
+        self.show_popup(f"Chrome trace written to: [b]{p}[/b]")
+
+    @traced("load image")
+    def on_image_path(self, *args):
+        if not self.image_path:
+            return
+        path = Path(self.image_path)
+        if path == self.shown_path:
+            return
+        try:
+            frame = self.request_frame(path)
+        except Exception as e:
+            # Frames that are truncated or still being written are common in capture folders.
+            print("Could not load", path, e)
+            self.load_error = e
+            self.image_path = str(self.shown_path) if self.shown_path is not None else None
+            return
+
+        self.shown_path = path
+        if path.parent != self.frame_folder:
+            self.frame_folder = path.parent
+            if self.watcher is not None:
+                self.stop_watching()
+                self.start_watching()
+        # Listed again only when one of the folders changed, see FrameSet.
+        self.frame_paths = list(self.get_frame_paths())
+        if frame is not None:
+            self.show_frame(frame)
+        self.prefetch_neighbours()
+
+    def request_frame(self, path: Path) -> Optional[PreparedFrame]:
+        future = self.prefetcher.request(path)
+        if not future.done():
+            with PILImage.open(path) as probe:
+                size = probe.size
+            if needs_preview(size):
+                # Shown at reduced size now, the full frame follows in _on_frame_loaded.
+                self.show_preview(path, size)
+                future.add_done_callback(lambda f: Clock.schedule_once(partial(self._on_frame_loaded, path)))
+                return None
+        return self.prefetcher.get(path)
+
+    def show_frame(self, frame: PreparedFrame):
+        self.frame = frame
+        self.image = frame.image
+
+    @traced("preview image")
+    def show_preview(self, path: Path, size):
+        self.frame = None
+        self.image = None
+        preview = load_preview(path)
+        if preview is None:
+            self.viewer.set_texture(None, image_size=size)
+        else:
+            self.viewer.set_texture(self.pil_to_texture(preview), image_size=size)
+
+    def _on_frame_loaded(self, path: Path, *args):
+        if Path(self.image_path) != path:
+            return
+        try:
+            frame = self.prefetcher.get(path)
+        except Exception as e:
+            self.show_popup(f"Could not load: [b]{path}[/b]\n{e}")
+            return
+        self.show_frame(frame)
+
+    def get_frame_index(self) -> int:
+        try:
+            return self.frame_paths.index(Path(self.image_path))
+        except ValueError:
+            return -1
+
+    def prefetch_neighbours(self):
+        index = self.get_frame_index()
+        # Huge frames are not read ahead, a few of them would not fit in memory.
+        if index < 0 or needs_preview(self.viewer.image_size):
+            return
+        self.prefetcher.prefetch(self.frame_paths[index + 1:index + 1 + self.prefetch_ahead])
+        if index > 0:
+            self.prefetcher.request(self.frame_paths[index - 1])
+        # Requested last so the shown frame is the last to be evicted.
+        self.prefetcher.request(self.frame_paths[index])
+
+    def _on_frame_prefetched(self, frame: PreparedFrame):
+        if not needs_preview(frame.image.size):
+            Clock.schedule_once(partial(self._upload_frame_texture, frame))
+
+    @staticmethod
+    def _texture_data(pixels: np.ndarray):
+        # Kivy takes bytes or a writable buffer, canonical pixel buffers are read-only views of bytes.
+        if isinstance(pixels.base, bytes) and len(pixels.base) == pixels.nbytes:
+            return pixels.base
+        if pixels.flags.writeable and pixels.flags.c_contiguous:
+            return pixels.reshape(-1)
+        return pixels.tobytes()
+
+    @staticmethod
+    def pixels_to_texture(pixels: np.ndarray) -> Texture:
+        colorfmt = "rgba" if pixels.shape[2] == 4 else "rgb"
+        with span("texture upload"):
+            texture = Texture.create(size=(pixels.shape[1], pixels.shape[0]), colorfmt=colorfmt)
+            texture.blit_buffer(SpriteEditorWidget._texture_data(pixels), colorfmt=colorfmt, bufferfmt="ubyte")
+            texture.flip_vertical()
+        return texture
+
+    @staticmethod
+    def pil_to_texture(pil) -> Texture:
+        with span("convert"):
+            pixels = np.asarray(pil.convert("RGB"))
+        return SpriteEditorWidget.pixels_to_texture(pixels)
+
+    def fits_texture(self, size) -> bool:
+        if SpriteEditorWidget.max_texture_size is None:
+            SpriteEditorWidget.max_texture_size = glGetIntegerv(GL_MAX_TEXTURE_SIZE)[0]
+        return max(size) <= self.max_texture_size
+
+    def _upload_frame_texture(self, frame: PreparedFrame, *args):
+        if frame.texture is None and self.fits_texture(frame.image.size):
+            frame.texture = self.pixels_to_texture(frame.pixels)
+
+    @traced("preview image")
+    def show_reduced(self, frame: PreparedFrame):
+        # Frames above the GL texture size are drawn from a reduced copy, operations still use full resolution.
+        preview = load_preview(frame.path)
+        if preview is None:
+            with span("convert"):
+                preview = frame.image.reduce(preview_factor(frame.image.size))
+        self.viewer.set_texture(self.pil_to_texture(preview), image_size=frame.image.size)
+
+    def step_frame(self, offset):
+        if not self.image_path:
+            return
+        index = self.get_frame_index()
+        if index < 0:
+            return
+        # Unreadable frames are skipped, the popup only comes when no readable frame is left.
+        skipped = 0
+        index += offset
+        while 0 <= index < len(self.frame_paths):
+            if self.load_image(str(self.frame_paths[index]), show_errors=False):
+                return
+            skipped += 1
+            index += offset
+        if skipped > 0:
+            self.show_popup(f"Could not load the next [b]{skipped}[/b] frames")
+
+    def previous_frame_press(self, *args):
+        self.step_frame(-1)
+
+    def next_frame_press(self, *args):
+        self.step_frame(1)
+
+    def load_image(self, path, show_errors: bool = True) -> bool:
+        self.load_error = None
+        self.image_path = path
+        if self.load_error is None:
+            return True
+        if show_errors:
+            self.show_popup(f"Could not load: [b]{path}[/b]\n{self.load_error}")
+        return False
+
+    def on_image(self, sender, image: PILImage):
+        self._image_fingerprint = None
+        if image is None:
+            return
+        print("Image set")
+        if self.frame is not None and self.frame.image is image:
+            self._upload_frame_texture(self.frame)
+            if self.frame.texture is None:
+                self.show_reduced(self.frame)
+            else:
+                self.viewer.set_texture(self.frame.texture)
+        else:
+            self.viewer.set_texture(self.pil_to_texture(image))
+        if self.overlay_updater == self.overlay_update_highlight_unique:
+            self.overlay_updater()
+
+    def select_press(self, *args):
+        self.viewer.tool = RegionTool()
+
+    def on_window_resize(self, window, width, height):
+        self.root.size = (width, height)
+
+
+class Tool:
+    def begin(self, editor: 'SpriteEditorViewer'):
+        pass
+
+    def end(self, editor: 'SpriteEditorViewer'):
+        pass
+
+    def down(self, editor: 'SpriteEditorViewer', touch):
+        pass
+
+    def up(self, editor: 'SpriteEditorViewer', touch):
+        pass
+
+    def move(self, editor: 'SpriteEditorViewer', touch):
+        pass
+
+
+class ZoomTool(Tool):
+    def down(self, editor: 'SpriteEditorViewer', touch):
+        local_pos = editor.image.to_local(touch.x, touch.y, relative=True)
+        if touch.button == "scrolldown":
+            editor.set_scale(editor.zoom_ratio, local_pos)
+            return True
+        elif touch.button == "scrollup":
+            editor.set_scale(1.0 / editor.zoom_ratio, local_pos)
+            return True
+
+
+class PanZoomTool(ZoomTool):
+    def move(self, editor: 'SpriteEditorViewer', touch):
+        editor.image.x += touch.dx
+        editor.image.y += touch.dy
+        super().move(editor, touch)
+
+
+class RegionTool(Tool):
+    def begin(self, editor: 'SpriteEditorViewer'):
+        editor.selection.visible = False
+        editor.selection.sel_x = 0
+        editor.selection.sel_y = 0
+        editor.selection.sel_width = 0
+        editor.selection.sel_height = 0
+        editor.owner.select_button.background_color = [0, 1, 0, 1]
+
+    def end(self, editor: 'SpriteEditorViewer'):
+        editor.owner.select_button.background_color = [1, 1, 1, 1]
+
+    def down(self, editor: 'SpriteEditorViewer', touch):
+        local_pos = editor.window_pos_to_image((touch.x, touch.y))
+        editor.selection.sel_x = local_pos[0]
+        editor.selection.sel_y = local_pos[1]
+        editor.selection.visible = True
+
+    def move(self, editor: 'SpriteEditorViewer', touch):
+        local_pos = editor.window_pos_to_image((touch.x, touch.y))
+        editor.selection.sel_width = (local_pos[0] - editor.selection.sel_x) + 1
+        editor.selection.sel_height = (local_pos[1] - editor.selection.sel_y) + 1
+
+    def up(self, editor: 'SpriteEditorViewer', touch):
+        local_pos = editor.window_pos_to_image((touch.x, touch.y))
+        editor.selection.sel_width = (local_pos[0] - editor.selection.sel_x) + 1
+        editor.selection.sel_height = (local_pos[1] - editor.selection.sel_y) + 1
+        editor.tool = PanZoomTool()
+
+
+class RegionSelection(FloatLayout):
+    sel_x = NumericProperty(0.0)
+    sel_y = NumericProperty(0.0)
+    sel_width = NumericProperty(0.0)
+    sel_height = NumericProperty(0.0)
+    visible = BooleanProperty(False)
+    rect = ObjectProperty(None)
+
+    @property
+    def overlay(self):
+        return self._overlay
+
+    @overlay.setter
+    def overlay(self, overlay):
+        self._overlay = overlay
+        if self._overlay is None:
+            self.overlay_image.texture = None
+            self.overlay_image.opacity = 0.0
+        else:
+            self.overlay_image.texture = self.overlay
+            self.overlay_image.opacity = 1.0
+
+    def __init__(self, viewer: 'SpriteEditorViewer' = None, **kwargs):
+        super(RegionSelection, self).__init__(**kwargs)
+        self.viewer = viewer
+        self.bind(sel_x=self.update, sel_y=self.update, sel_width=self.update, sel_height=self.update)
+        self.bind(sel_x=self.update_overlay, sel_y=self.update_overlay, sel_width=self.update_overlay,
+                  sel_height=self.update_overlay)
+        self.viewer.image.bind(size=self.update, pos=self.update)
+        self.viewer.bind(xscale=self.update, yscale=self.update)
+        self.bind(visible=self.redraw)
+        self.overlay_image = SpriteEditorImage(allow_stretch=True, nocache=True, size_hint=(None, None))
+        self.add_widget(self.overlay_image)
+        self.overlay_image.opacity = 0.0
+        self._overlay: Optional[Texture] = None
+        self.register_event_type('on_update')
+
+        self._keyboard = Window.request_keyboard(
+            self._keyboard_closed, self, 'text')
+        if self._keyboard.widget:
+            pass
+        self._keyboard.bind(on_key_down=self._on_keyboard_down)
+
+    def _keyboard_closed(self):
+        print('My keyboard have been closed!')
+        self._keyboard.unbind(on_key_down=self._on_keyboard_down)
+        self._keyboard = None
+
+    def _on_keyboard_down(self, keyboard, keycode, text, modifiers):
+        amount = 1
+        if "shift" in modifiers:
+            amount = 5
+
+        if keycode[1] == "pageup":
+            self.viewer.owner.previous_frame_press()
+            return True
+        elif keycode[1] == "pagedown":
+            self.viewer.owner.next_frame_press()
+            return True
+
+        if "alt" in modifiers:
+            if keycode[1] == "up":
+                self.sel_height += amount
+                self.sel_y -= amount
+                return True
+            elif keycode[1] == "down":
+                self.sel_height -= amount
+                self.sel_y += amount
+                return True
+            elif keycode[1] == "left":
+                self.sel_width += amount
+                self.sel_x -= amount
+                return True
+            elif keycode[1] == "right":
+                self.sel_width -= amount
+                self.sel_x += amount
+                return True
+        elif "ctrl" in modifiers:
+            if keycode[1] == "up":
+                self.sel_height -= amount
+                return True
+            elif keycode[1] == "down":
+                self.sel_height += amount
+                return True
+            elif keycode[1] == "left":
+                self.sel_width -= amount
+                return True
+            elif keycode[1] == "right":
+                self.sel_width += amount
+                return True
+        else:
+            if keycode[1] == "up":
+                self.sel_y -= amount
+                return True
+            elif keycode[1] == "down":
+                self.sel_y += amount
+                return True
+            elif keycode[1] == "left":
+                self.sel_x -= amount
+                return True
+            elif keycode[1] == "right":
+                self.sel_x += amount
+                return True
+
+        return False
+
+    def on_update(self, *args):
+        pass
+
+    def update_overlay(self, *args):
+        if self.sel_width > 0 and self.sel_height > 0:
+            self.dispatch("on_update")
+        else:
+            self.overlay = None
+
+    def update(self, *args):
+        if self.rect is None:
+            self.redraw()
+            return
+
+        self.rect.pos = self.viewer.image_pos_to_window((self.sel_x, self.sel_y + self.sel_height))
+        self.rect.size = self.viewer.image_size_to_window(self.sel_width, self.sel_height)
+
+        self.rect2.rectangle = (self.rect.pos[0], self.rect.pos[1], self.rect.size[0], self.rect.size[1])
+
+        self.overlay_image.pos = self.rect.pos
+        self.overlay_image.size = self.rect.size
+
+        self.viewer.owner.sel_x_label.set_value(self.sel_x)
+        self.viewer.owner.sel_y_label.set_value(self.sel_y)
+        self.viewer.owner.sel_width_label.set_value(self.sel_width)
+        self.viewer.owner.sel_height_label.set_value(self.sel_height)
+
+    def redraw(self, *args):
+        # self.canvas.clear()
+        if not self.visible:
+            self.opacity = 0.0
+            return
+        else:
+            self.opacity = 1.0
+
+        with self.canvas:
+            Color(0.5, 1, 0.5, 0.3)
+            self.rect = Rectangle()
+            Color(1, 1, 0, 0.7)
+            self.rect2 = Line(rectangle=(0, 0, 0, 0), width=1.2)
+        self.update()
+
+
+class SpriteEditorViewer(FloatLayout, StencilView):
+    image = ObjectProperty(None)
+    selection = ObjectProperty(None)
+    zoom_ratio = NumericProperty(1.04)
+    xscale = NumericProperty(1.0)
+    yscale = NumericProperty(1.0)
+
+    def __init__(self, owner=None, **kwargs):
+        super(SpriteEditorViewer, self).__init__(**kwargs)
+        self.image_size = (0, 0)
+
+        self.image = SpriteEditorImage(allow_stretch=True, nocache=True, size_hint=(None, None))
+        self.add_widget(self.image)
+        self.owner: 'SpriteEditorWidget' = owner
+
+        self.grid = SpriteEditorGrid(owner=self.image, viewer=self, size_hint=(None, None))
+        self.add_widget(self.grid)
+        self._tool: Generic[Tool] = None
+        self.tool = PanZoomTool()
+
+        self.selection = RegionSelection(viewer=self)
+        self.add_widget(self.selection)
+
+        Clock.schedule_interval(partial(self.update_info_callback), 0.05)
+
+    @property
+    def tool(self):
+        return self._tool
+
+    @tool.setter
+    def tool(self, value):
+        if self._tool is not None:
+            self._tool.end(self)
+        self._tool = value
+        self._tool.begin(self)
+
+    def image_size_to_window(self, width, height):
+        return width * self.xscale, height * self.yscale
+
+    def image_pos_to_window(self, pos):
+        local_pos = list(pos)
+        local_pos[0] *= self.xscale
+        local_pos[1] *= self.yscale
+        local_pos[1] = self.image.height - local_pos[1]
+        win_pos = self.image.to_window(local_pos[0], local_pos[1], initial=False, relative=True)
+        return list(win_pos)
+
+    def window_pos_to_image(self, pos):
+        local_pos = list(self.image.to_local(pos[0], pos[1], relative=True))
+
+        local_pos[1] = self.image.size[1] - local_pos[1]
+
+        local_pos[0] /= self.xscale
+        local_pos[1] /= self.yscale
+
+        if local_pos[0] < 0:
+            local_pos[0] = 0
+
+        if local_pos[1] < 0:
+            local_pos[1] = 0
+
+        if local_pos[0] >= self.image_size[0]:
+            local_pos[0] = self.image_size[0] - 1
+
+        if local_pos[1] >= self.image_size[1]:
+            local_pos[1] = self.image_size[1] - 1
+
+        local_pos[0] = int(local_pos[0])
+        local_pos[1] = int(local_pos[1])
+        return local_pos
+
+    def get_mouse_image_pos(self):
+        pos = Window.mouse_pos
+        local_pos = self.window_pos_to_image(pos)
+        return local_pos
+
+    def update_info_callback(self, dt):
+        if self.image.texture is None:
+            return
+
+        local_pos = self.get_mouse_image_pos()
+        self.owner.x_label.set_value(local_pos[0])
+        self.owner.y_label.set_value(local_pos[1])
+
+    def toggle_grid(self, value=None):
+        if value is None:
+            self.grid.visible = not self.grid.visible
+        else:
+            self.grid.visible = value
+        pass
+
+    def set_scale(self, value, local_pos):
+        self.image.size = (self.image.size[0] * value, self.image.size[1] * value)
+
+        self.image.x -= local_pos[0] * (value - 1.0)
+        self.image.y -= local_pos[1] * (value - 1.0)
+
+        self.xscale = self.image.size[0] / self.image_size[0]
+        self.yscale = self.image.size[1] / self.image_size[1]
+
+    def set_texture(self, texture, image_size=None):
+        # Previews use smaller textures, positions and selection always stay in full resolution image space.
+        if image_size is None:
+            image_size = texture.size
+        previous_size = self.image_size
+        self.image_size = tuple(image_size)
+        self.image.texture = texture
+        if previous_size != self.image_size:
+            self.reset_zoom()
+
+    def reset_zoom(self):
+        self.image.size = self.image_size
+        self.xscale = 1.0
+        self.yscale = 1.0
+        self.image.pos = (0.0, 0.0)
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super(SpriteEditorViewer, self).on_touch_down(touch)
+
+        self._tool.down(self, touch)
+        return super(SpriteEditorViewer, self).on_touch_down(touch)
+
+    def on_touch_move(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super(SpriteEditorViewer, self).on_touch_move(touch)
+
+        self._tool.move(self, touch)
+        return super(SpriteEditorViewer, self).on_touch_move(touch)
+
+    def on_touch_up(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super(SpriteEditorViewer, self).on_touch_up(touch)
+
+        self._tool.up(self, touch)
+        return super(SpriteEditorViewer, self).on_touch_up(touch)
+
+
+class SpriteEditorGrid(Widget):
+    visible = BooleanProperty(False)
+
+    def __init__(self, owner: 'SpriteEditorImage' = None, viewer: SpriteEditorViewer = None, **kwargs):
+        super(SpriteEditorGrid, self).__init__(**kwargs)
+        self.owner = owner
+        self.viewer = viewer
+        self.owner.bind(size=self.redraw, pos=self.redraw)
+        self.bind(visible=self.redraw)
+
+    def update(self, *args):
+        self.pos = self.owner.pos
+        self.size = self.owner.size
+        self.redraw()
+
+    def redraw(self, *args):
+        # self.update()
+        self.canvas.clear()
+        if not self.visible:
+            return
+
+        self.pos = self.owner.pos
+        self.size = self.owner.size
+
+        width = self.viewer.image_size[0]
+        height = self.viewer.image_size[1]
+        if width == 0 or height == 0:
+            return
+
+        h_stride = self.width / width
+        v_stride = self.height / height
+
+        if h_stride < 8 or v_stride < 8:
+            return
+
+        grid = InstructionGroup()
+
+        startx = int(-self.owner.pos[0] / h_stride)
+        if startx < 0:
+            startx = 0
+
+        starty = int(-self.owner.pos[1] / v_stride)
+        if starty < 0:
+            starty = 0
+
+        endx = int(self.viewer.size[0] / h_stride + startx + 2)
+        endy = int(self.viewer.size[1] / v_stride + starty + 2)
+        if endy >= height + 1:
+            endy = height + 1
+
+        if endx >= width + 1:
+            endx = width + 1
+
+        grid.add(Color(1, 1, 1))
+        for y in range(starty, endy):
+            grid.add(Line(points=[int(self.x + 0), int(self.y + y * v_stride), int(self.x + self.width),
+                                  int(self.y + y * v_stride)]))
+        for x in range(startx, endx):
+            grid.add(Line(points=[int(self.x + x * h_stride), int(self.y + 0), int(self.x + x * h_stride),
+                                  int(self.y + self.height)]))
+
+        self.canvas.add(grid)
+
+
+class SpriteEditorImage(Image):
+    def __init__(self, **kwargs):
+        super(SpriteEditorImage, self).__init__(**kwargs)
+        self.bind(texture=self.update_texture_filters)
+
+    def update_texture_filters(self, *args):
+        if self.texture == None: return
+        self.texture.min_filter = 'nearest'
+        self.texture.mag_filter = 'nearest'
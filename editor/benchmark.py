@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+from editor import operations, palette
+from editor.trace import tracer
+
+DEFAULT_SIZES = "64x64,128x128,256x256"
+DEFAULT_OPERATIONS = ["find_unique_colors", "highlight_unique", "extract_transparent",
+                      "extract_transparent_black", "index_colors", "find_unique_colors_indexed",
+                      "highlight_unique_indexed"]
+GUI_OPERATIONS = ["pil_to_core", "grid_redraw"]
+TILE_SIZE = 8
+
+
+def _palette(random: np.random.RandomState, colors: int, odd: bool) -> np.ndarray:
+    # Background colors have even channels and sprite colors odd ones, so sprite colors are always unique.
+    palette = random.randint(0, 256, (colors, 3)).astype(np.uint8)
+    if odd:
+        return palette | 1
+    return palette & 0xFE
+
+
+def sprite_region(width: int, height: int) -> operations.Region:
+    return width * 3 // 8, height * 3 // 8, width * 5 // 8, height * 5 // 8
+
+
+def generate_frame(width: int, height: int, colors: int = 16, seed: int = 0,
+                   sprite_seed: int = 0) -> PILImage:
+    random = np.random.RandomState(seed)
+    background = _palette(random, colors, False)
+    tiles = random.randint(0, colors, ((height + TILE_SIZE - 1) // TILE_SIZE, (width + TILE_SIZE - 1) // TILE_SIZE))
+    tiles = tiles.repeat(TILE_SIZE, axis=0).repeat(TILE_SIZE, axis=1)[:height, :width]
+    pixels = background[tiles]
+
+    random = np.random.RandomState(sprite_seed)
+    sprite_colors = _palette(random, colors, True)
+    x1, y1, x2, y2 = sprite_region(width, height)
+    sprite = random.randint(0, colors, (y2 - y1, x2 - x1))
+    mask = random.randint(0, 2, sprite.shape).astype(bool)
+    area = pixels[y1:y2, x1:x2]
+    area[mask] = sprite_colors[sprite[mask]]
+    return PILImage.fromarray(pixels, "RGB")
+
+
+def generate_frame_folder(path, width: int, height: int, colors: int = 16, frames: int = 8,
+                          seed: int = 0) -> List[Path]:
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    result = []
+    for i in range(frames):
+        frame_path = path / f"frame_{i:05d}.png"
+        generate_frame(width, height, colors, seed + i, seed).save(frame_path)
+        result.append(frame_path)
+    return result
+
+
+def measure(function: Callable, repeat: int) -> Dict[str, float]:
+    runs = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {"min": min(runs), "mean": statistics.mean(runs), "runs": runs}
+
+
+def _gui_cases(image: PILImage) -> Dict[str, Callable]:
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    from kivy.graphics.texture import Texture
+    from kivy.uix.widget import Widget
+    from editor.app import SpriteEditorWidget, SpriteEditorGrid, SpriteEditorImage
+
+    width, height = image.size
+    owner = SpriteEditorImage(allow_stretch=True, nocache=True, size_hint=(None, None))
+    owner.texture = Texture.create(size=(width, height))
+    owner.size = (width * TILE_SIZE, height * TILE_SIZE)
+    viewer = Widget(size=(1280, 720))
+    viewer.image_size = (width, height)
+    grid = SpriteEditorGrid(owner=owner, viewer=viewer, size_hint=(None, None))
+    grid.visible = True
+
+    return {
+        # Named after the old PIL to CoreImage conversion it replaced, so earlier baselines still compare.
+        "pil_to_core": lambda: SpriteEditorWidget.pil_to_texture(image),
+        "grid_redraw": grid.redraw,
+    }
+
+
+def run(sizes: List[Tuple[int, int]], colors: int, frames: int, repeat: int, names: List[str],
+        workdir: Path) -> List[Dict]:
+    results = []
+    for width, height in sizes:
+        folder = workdir / f"{width}x{height}"
+        frame_paths = generate_frame_folder(folder, width, height, colors, frames)
+        image = PILImage.open(frame_paths[0])
+        image.load()
+        pixels = operations.to_pixels(image)
+        region = sprite_region(width, height)
+        indexed = palette.index_frame(pixels)
+
+        cases = {
+            "find_unique_colors": lambda: operations.find_unique_colors(pixels, region),
+            "highlight_unique": lambda: operations.highlight_unique(pixels, region),
+            "extract_transparent": lambda: operations.extract_transparent(frame_paths, region),
+            "extract_transparent_black": lambda: operations.extract_transparent_black(frame_paths, region),
+            "index_colors": lambda: palette.index_frame(pixels),
+            "find_unique_colors_indexed": lambda: palette.find_unique_colors(indexed, region),
+            "highlight_unique_indexed": lambda: palette.highlight_unique(indexed, region),
+        }
+        if any(name in GUI_OPERATIONS for name in names):
+            cases.update(_gui_cases(image))
+
+        for name in names:
+            result = {"name": name, "width": width, "height": height, "colors": colors, "frames": frames}
+            result.update(measure(cases[name], repeat))
+            results.append(result)
+            print(f"{name:<28} {width:>5}x{height:<5} min {result['min'] * 1000:10.2f} ms"
+                  f"  mean {result['mean'] * 1000:10.2f} ms", file=sys.stderr)
+    return results
+
+
+def result_key(result: Dict) -> Tuple:
+    return result["name"], result["width"], result["height"], result["colors"], result["frames"]
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[Dict]:
+    baseline_by_key = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(result_key(result))
+        if previous is None:
+            continue
+        result["baseline"] = previous["min"]
+        result["ratio"] = result["min"] / previous["min"] if previous["min"] > 0 else 1.0
+        if result["ratio"] > 1.0 + tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for item in text.split(","):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m editor.benchmark",
+                                     description="Times spritex operations on synthetic frames.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated WIDTHxHEIGHT list")
+    parser.add_argument("--colors", type=int, default=16, help="colors per frame palette")
+    parser.add_argument("--frames", type=int, default=8, help="frames per synthetic folder")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--operations", default=",".join(DEFAULT_OPERATIONS),
+                        help="comma separated operations, available: "
+                             + ", ".join(DEFAULT_OPERATIONS + GUI_OPERATIONS))
+    parser.add_argument("--gui", action="store_true", help="also time pil_to_core and grid_redraw (opens a window)")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown relative to baseline before failing (0.2 = 20%%)")
+    parser.add_argument("--trace", help="write a Chrome trace of the run to this file")
+    args = parser.parse_args(argv)
+
+    names = [name for name in args.operations.split(",") if name]
+    if args.gui:
+        names += [name for name in GUI_OPERATIONS if name not in names]
+    for name in names:
+        if name not in DEFAULT_OPERATIONS + GUI_OPERATIONS:
+            parser.error(f"unknown operation: {name}")
+
+    tracer.enabled = bool(args.trace)
+    with tempfile.TemporaryDirectory(prefix="spritex-bench-") as workdir:
+        results = run(parse_sizes(args.sizes), args.colors, args.frames, args.repeat, names, Path(workdir))
+    if args.trace:
+        tracer.export(args.trace)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PILImage.__version__,
+        "machine": platform.machine(),
+        "results": results,
+        "regressions": [result_key(result) for result in regressions],
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    for result in regressions:
+        print(f"REGRESSION {result['name']} {result['width']}x{result['height']}: "
+              f"{result['min'] * 1000:.2f} ms vs {result['baseline'] * 1000:.2f} ms", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image as PILImage
+
+from editor import operations
+from editor.trace import span
+
+CACHE_DIRECTORY = Path.home() / ".cache" / "spritex"
+DISK_CACHE_BYTES = 1024 * 1024 * 1024
+# Results are stored as PNG for images and npz for anything else, .pickle files are left by older versions.
+DISK_SUFFIXES = (".png", ".npz")
+
+_MISSING = object()
+
+
+def frames_fingerprint(frames: Sequence[Path]) -> str:
+    # Frame sets are identified by name, size and modification time so nothing has to be decoded. Paths are
+    # made absolute without resolving links, resolving every frame costs several times more than its stat.
+    digest = hashlib.sha1()
+    for frame in frames:
+        stat = os.stat(frame)
+        digest.update(f"{os.path.abspath(frame)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class FrameSet:
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self._paths: Optional[List[Path]] = None
+        self._directories: Dict[str, int] = {}
+
+    def _changed(self) -> bool:
+        try:
+            return any(os.stat(directory).st_mtime_ns != mtime for directory, mtime in self._directories.items())
+        except FileNotFoundError:
+            return True
+
+    @property
+    def paths(self) -> List[Path]:
+        # Listed again only when one of the directories changed, not on every operation.
+        if self._paths is None or self._changed():
+            self._directories = {}
+            self._paths = operations.list_frames(self.folder, self._directories)
+        return self._paths
+
+    @property
+    def fingerprint(self) -> str:
+        # Not kept between calls, frames rewritten in place change neither the list nor the directory mtimes.
+        paths = self.paths
+        with span("fingerprint"):
+            return frames_fingerprint(paths)
+
+    def invalidate(self):
+        self._paths = None
+
+
+def pixels_fingerprint(pixels: np.ndarray) -> str:
+    digest = hashlib.sha1(repr(pixels.shape).encode("ascii"))
+    digest.update(np.ascontiguousarray(pixels).reshape(-1))
+    return digest.hexdigest()
+
+
+def trim_directory(directory: Path, max_bytes: int, suffix: str):
+    # Least recently used files go first, cache hits touch their file.
+    files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+             for entry in os.scandir(directory) if entry.name.endswith(suffix)]
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def estimate_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, PILImage.Image):
+        return value.size[0] * value.size[1] * len(value.getbands())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(estimate_size(item) for item in value)
+    return 32
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, directory: Optional[Path] = None,
+                 max_disk_bytes: int = DISK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = Path(directory) if directory is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(fingerprint: str, region, operation: str, **params) -> str:
+        text = repr((fingerprint, tuple(float(v) for v in region), operation, sorted(params.items())))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+    def _remember(self, key: str, value):
+        size = estimate_size(value)
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            evicted_key, (evicted, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def _load(self, key: str):
+        if self.directory is None:
+            return _MISSING
+        for suffix in DISK_SUFFIXES:
+            path = self.directory / f"{key}{suffix}"
+            try:
+                with span("cache load"):
+                    if suffix == ".png":
+                        value = operations.open_frame(path)
+                    else:
+                        with np.load(path) as data:
+                            value = data["value"]
+                            if str(data["kind"]) == "list":
+                                value = value.tolist()
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                # A damaged or outdated cache file is only a cache miss.
+                print("Could not read cached result:", e)
+                return _MISSING
+            path.touch()
+            return value
+        return _MISSING
+
+    def _store(self, key: str, value):
+        if value is None:
+            return
+        try:
+            with span("cache save"):
+                self.directory.mkdir(parents=True, exist_ok=True)
+                if isinstance(value, PILImage.Image):
+                    path = self.directory / f"{key}.png"
+                    temp_path = path.with_suffix(".tmp")
+                    value.save(temp_path, "png")
+                else:
+                    path = self.directory / f"{key}.npz"
+                    temp_path = path.with_suffix(".tmp")
+                    kind = "array" if isinstance(value, np.ndarray) else "list"
+                    with open(temp_path, "wb") as f:
+                        np.savez(f, value=np.asarray(value), kind=np.array(kind))
+                temp_path.replace(path)
+            trim_directory(self.directory, self.max_disk_bytes, DISK_SUFFIXES + (".pickle",))
+        except OSError as e:
+            print("Could not cache result:", e)
+
+    def get(self, key: str, default=None):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        value = self._load(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value, persist: bool = False):
+        self._remember(key, value)
+        if persist and self.directory is not None:
+            self._store(key, value)
+
+    def memoize(self, fingerprint: str, region, operation: str, compute: Callable[[], Any],
+                persist: bool = False, **params):
+        key = self.make_key(fingerprint, region, operation, **params)
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value, persist)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,165 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image as PILImage
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# Near duplicates must also agree on a coarse RGB thumbnail, hashes alone are grayscale.
+SIGNATURE_SIZE = 4
+COLOR_TOLERANCE = 12
+
+
+def exact_hash(image: PILImage) -> str:
+    digest = hashlib.sha1()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _bits_to_int(bits) -> int:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def average_hash(image: PILImage) -> int:
+    small = image.convert("L").resize((HASH_SIZE, HASH_SIZE), PILImage.BILINEAR)
+    pixels = list(small.getdata())
+    mean = sum(pixels) / len(pixels)
+    return _bits_to_int(pixel > mean for pixel in pixels)
+
+
+def difference_hash(image: PILImage) -> int:
+    small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), PILImage.BILINEAR)
+    pixels = list(small.getdata())
+    bits = []
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        bits.extend(row[x] > row[x + 1] for x in range(HASH_SIZE))
+    return _bits_to_int(bits)
+
+
+def color_signature(image: PILImage) -> bytes:
+    return image.convert("RGB").resize((SIGNATURE_SIZE, SIGNATURE_SIZE), PILImage.BOX).tobytes()
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def color_distance(a: bytes, b: bytes) -> int:
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def is_flat(ahash: int, dhash: int) -> bool:
+    # Every single color crop hashes to zero, those are only matched by content.
+    return ahash == 0 and dhash == 0
+
+
+class DedupIndex:
+    def __init__(self, threshold: int = 3):
+        self.threshold = threshold
+        self.exact: Dict[str, str] = {}
+        self.entries: List[Tuple[int, int, Tuple[int, int], bytes, str]] = []
+        # With threshold t, two hashes within distance t agree on at least one of t + 1 bands,
+        # so only entries sharing a band value have to be compared.
+        band_count = threshold + 1
+        band_bits = HASH_BITS // band_count
+        self.bands = [(i * band_bits, HASH_BITS if i == band_count - 1 else (i + 1) * band_bits)
+                      for i in range(band_count)]
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _band_keys(self, dhash: int):
+        for i, (start, end) in enumerate(self.bands):
+            yield i, (dhash >> start) & ((1 << (end - start)) - 1)
+
+    def _find_similar(self, ahash: int, dhash: int, size: Tuple[int, int], signature: bytes) -> Optional[str]:
+        if is_flat(ahash, dhash):
+            return None
+        seen = set()
+        for key in self._band_keys(dhash):
+            for entry_id in self.buckets.get(key, ()):
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                entry_ahash, entry_dhash, entry_size, entry_signature, name = self.entries[entry_id]
+                if entry_size == size and hamming_distance(dhash, entry_dhash) <= self.threshold and \
+                        hamming_distance(ahash, entry_ahash) <= self.threshold and \
+                        color_distance(signature, entry_signature) <= COLOR_TOLERANCE:
+                    return name
+        return None
+
+    def _insert(self, content: str, ahash: int, dhash: int, size: Tuple[int, int], signature: bytes, name: str):
+        self.exact[content] = name
+        entry_id = len(self.entries)
+        self.entries.append((ahash, dhash, size, signature, name))
+        if is_flat(ahash, dhash):
+            return
+        for key in self._band_keys(dhash):
+            self.buckets.setdefault(key, []).append(entry_id)
+
+    def find(self, image: PILImage) -> Optional[str]:
+        content = exact_hash(image)
+        if content in self.exact:
+            return self.exact[content]
+        return self._find_similar(average_hash(image), difference_hash(image), image.size, color_signature(image))
+
+    def add(self, image: PILImage, name: str) -> Optional[str]:
+        content = exact_hash(image)
+        duplicate = self.exact.get(content)
+        if duplicate is None:
+            ahash = average_hash(image)
+            dhash = difference_hash(image)
+            signature = color_signature(image)
+            duplicate = self._find_similar(ahash, dhash, image.size, signature)
+            if duplicate is None:
+                self._insert(content, ahash, dhash, image.size, signature, name)
+                return None
+        self.skipped += 1
+        return duplicate
+
+    def save(self, path):
+        data = {
+            "threshold": self.threshold,
+            "exact": self.exact,
+            "entries": [[f"{ahash:016x}", f"{dhash:016x}", f"{size[0]}x{size[1]}", signature.hex(), name]
+                        for ahash, dhash, size, signature, name in self.entries]
+        }
+        path = Path(path)
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        temp_path.replace(path)
+
+    @classmethod
+    def load(cls, path, threshold: int = 3) -> 'DedupIndex':
+        path = Path(path)
+        if not path.exists():
+            return cls(threshold)
+
+        with open(path) as f:
+            data = json.load(f)
+
+        index = cls(data.get("threshold", threshold))
+        names = {}
+        for entry in data["entries"]:
+            # Entries written before sizes and color signatures were stored only match by content.
+            if len(entry) != 5:
+                continue
+            ahash, dhash, size, signature, name = entry
+            width, height = (int(v) for v in size.split("x"))
+            names[name] = (int(ahash, 16), int(dhash, 16), (width, height), bytes.fromhex(signature))
+        for content, name in data["exact"].items():
+            if name in names:
+                index._insert(content, *names.pop(name), name)
+            else:
+                index.exact[content] = name
+        return index
@@ -0,0 +1,161 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional
+
+import numpy as np
+from PIL import Image as PILImage
+
+from editor import operations
+from editor.dedup import DedupIndex
+from editor.trace import span, tracer
+
+CHANNELS = {"rgb": 3, "rgba": 4}
+
+
+class RawFrameReader:
+    def __init__(self, stream: BinaryIO, width: int, height: int, pixel_format: str = "rgb"):
+        if pixel_format not in CHANNELS:
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
+        self.stream = stream
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.frame_size = width * height * CHANNELS[pixel_format]
+        self.buffer = bytearray(self.frame_size)
+        self._view = memoryview(self.buffer)
+        # Every frame is read into the same buffer, so this array is only valid until the next read.
+        self.pixels = np.frombuffer(self.buffer, dtype=np.uint8).reshape(height, width, CHANNELS[pixel_format])
+        self.frames = 0
+
+    def read(self) -> bool:
+        with span("read"):
+            filled = 0
+            while filled < self.frame_size:
+                count = self.stream.readinto(self._view[filled:])
+                if not count:
+                    break
+                filled += count
+
+        if filled == 0:
+            return False
+        if filled < self.frame_size:
+            raise ValueError(f"Stream ended in the middle of frame {self.frames}: "
+                             f"got {filled} of {self.frame_size} bytes")
+        self.frames += 1
+        return True
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        while self.read():
+            yield self.pixels
+
+
+def to_image(pixels: np.ndarray) -> PILImage:
+    return PILImage.fromarray(pixels, "RGBA" if pixels.shape[2] == 4 else "RGB")
+
+
+def ingest_transparent(reader: RawFrameReader, region: operations.Region) -> PILImage:
+    x1, y1, x2, y2 = (int(v) for v in region)
+    accumulator = operations.TransparentAccumulator(region)
+    for pixels in reader:
+        accumulator.add(pixels[y1:y2, x1:x2])
+    if accumulator.reference is None:
+        raise ValueError("No frames read")
+    return accumulator.transparent()
+
+
+def ingest_unique_colors(reader: RawFrameReader, region: operations.Region) -> List[List[int]]:
+    accumulator = operations.UniqueColorAccumulator(region)
+    for pixels in reader:
+        accumulator.add(pixels)
+    return accumulator.unique_colors()
+
+
+def run_prefix(output: Path) -> str:
+    # Every run names its crops differently, so runs into the same folder never overwrite earlier crops.
+    base = f"frame_{time.strftime('%Y%m%d%H%M%S', time.localtime())}"
+    prefix = base
+    count = 1
+    while any(output.glob(f"{prefix}_*.png")):
+        count += 1
+        prefix = f"{base}-{count}"
+    return prefix
+
+
+def ingest_crops(reader: RawFrameReader, region: operations.Region, output: Path,
+                 index: Optional[DedupIndex] = None) -> int:
+    x1, y1, x2, y2 = (int(v) for v in region)
+    output.mkdir(parents=True, exist_ok=True)
+    prefix = run_prefix(output)
+    written = 0
+    for pixels in reader:
+        sprite = to_image(pixels[y1:y2, x1:x2])
+        name = f"{prefix}_{reader.frames - 1:06d}.png"
+        if index is not None:
+            with span("dedup"):
+                if index.add(sprite, name) is not None:
+                    continue
+        with span("save"):
+            sprite.save(output / name)
+        written += 1
+    return written
+
+
+def parse_region(text: str) -> operations.Region:
+    # Same (y1,x1,y2,x2) order as "Copy Region to Clipboard".
+    y1, x1, y2, x2 = (int(v) for v in text.strip("()").split(","))
+    return x1, y1, x2, y2
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m editor.ingest",
+                                     description="Runs spritex operations on raw frames read from stdin or a pipe.")
+    parser.add_argument("--width", type=int, required=True)
+    parser.add_argument("--height", type=int, required=True)
+    parser.add_argument("--format", choices=sorted(CHANNELS), default="rgb", help="pixel format of the frames")
+    parser.add_argument("--input", default="-", help="named pipe or file to read, stdin by default")
+    parser.add_argument("--region", type=parse_region, required=True, help="y1,x1,y2,x2")
+    parser.add_argument("--operation", choices=["transparent", "unique", "crop"], required=True)
+    parser.add_argument("--output", required=True, help="output image, or output folder for crop")
+    parser.add_argument("--dedup", action="store_true", help="skip duplicate crops, see dedup.json in output")
+    parser.add_argument("--trace", help="write a Chrome trace of the run to this file")
+    args = parser.parse_args(argv)
+
+    tracer.enabled = bool(args.trace)
+    if args.input == "-":
+        stream = sys.stdin.buffer
+    else:
+        stream = open(args.input, "rb", buffering=0)
+
+    reader = RawFrameReader(stream, args.width, args.height, args.format)
+    try:
+        if args.operation == "transparent":
+            ingest_transparent(reader, args.region).save(args.output)
+        elif args.operation == "unique":
+            unique_colors = ingest_unique_colors(reader, args.region)
+            if len(unique_colors) == 0:
+                print("No unique colors found", file=sys.stderr)
+                return 1
+            PILImage.fromarray(np.array([unique_colors], dtype=np.uint8), "RGB").save(args.output)
+        else:
+            output = Path(args.output)
+            index = None
+            if args.dedup:
+                index = DedupIndex.load(output / "dedup.json")
+            written = ingest_crops(reader, args.region, output, index)
+            if index is not None:
+                index.save(output / "dedup.json")
+            print(f"Written {written} sprites", file=sys.stderr)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+        if args.trace:
+            tracer.export(args.trace)
+
+    print(f"Read {reader.frames} frames", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
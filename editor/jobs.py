@@ -0,0 +1,381 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image as PILImage
+
+from editor import operations
+from editor.ingest import parse_region
+from editor.trace import span
+
+OPERATIONS = ["transparent", "unique"]
+CHUNK_FRAMES = 256
+CHECKPOINT_SECONDS = 30.0
+MANIFEST_VERSION = 1
+
+
+def process_start(pid: int) -> Optional[str]:
+    # Start time of the process in clock ticks since boot, Linux only. Tells a reused pid from the one that
+    # took a lock.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def lock_owner() -> str:
+    pid = os.getpid()
+    return f"{socket.gethostname()} {pid} {process_start(pid) or '-'}\n"
+
+
+def is_stale_lock(owner: str) -> bool:
+    parts = owner.split()
+    if len(parts) == 1:
+        # Lock files of earlier versions only hold the pid.
+        parts = [socket.gethostname(), parts[0], "-"]
+    host, pid, start = parts
+    if host != socket.gethostname():
+        # Processes of other hosts can not be checked, --force-unlock removes their locks.
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    # Pids are reused quickly in containers, another start time means the pid belongs to another process now.
+    current = process_start(int(pid))
+    return start != "-" and current is not None and current != start
+
+
+class ChunkState:
+    def __init__(self, region: operations.Region, names: Sequence[str]):
+        # Frames of the chunk already folded into the accumulators or skipped, always a prefix of the chunk.
+        self.done = 0
+        self.failed: List[str] = []
+        self.transparent = operations.TransparentAccumulator(region) if "transparent" in names else None
+        self.unique = operations.UniqueColorAccumulator(region) if "unique" in names else None
+
+    def add_image(self, image: PILImage):
+        if self.transparent is not None:
+            self.transparent.add_image(image)
+        if self.unique is not None:
+            self.unique.add_image(image)
+        self.done += 1
+
+    def skip(self, name: str):
+        self.failed.append(name)
+        self.done += 1
+
+    def merge(self, other: 'ChunkState'):
+        if self.transparent is not None:
+            self.transparent.merge(other.transparent)
+        if self.unique is not None:
+            self.unique.merge(other.unique)
+        self.done += other.done
+        self.failed += other.failed
+
+    def save(self, path: Path):
+        arrays = {"done": np.array(self.done), "failed": np.array(self.failed, dtype=str)}
+        if self.transparent is not None and self.transparent.reference is not None:
+            arrays["reference"] = self.transparent.reference
+            arrays["mask"] = self.transparent.mask
+        if self.unique is not None:
+            # Bitsets are stored as bits, 2 MB each instead of 16 MB.
+            arrays["inside"] = np.packbits(self.unique.inside)
+            arrays["outside"] = np.packbits(self.unique.outside)
+        with span("checkpoint"):
+            temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_path, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            temp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, region: operations.Region, names: Sequence[str]) -> 'ChunkState':
+        state = cls(region, names)
+        with np.load(path) as arrays:
+            state.done = int(arrays["done"])
+            if "failed" in arrays:
+                state.failed = arrays["failed"].tolist()
+            if state.transparent is not None and "reference" in arrays:
+                state.transparent.reference = arrays["reference"]
+                state.transparent.mask = arrays["mask"]
+                state.transparent.frames = state.done
+            if state.unique is not None:
+                state.unique.inside = np.unpackbits(arrays["inside"]).view(bool)
+                state.unique.outside = np.unpackbits(arrays["outside"]).view(bool)
+                state.unique.frames = state.done
+        return state
+
+
+class Job:
+    def __init__(self, directory: Path, manifest: Dict):
+        self.directory = Path(directory)
+        self.manifest = manifest
+
+    @property
+    def folder(self) -> Path:
+        return Path(self.manifest["folder"])
+
+    @property
+    def region(self) -> operations.Region:
+        return tuple(self.manifest["region"])
+
+    @property
+    def names(self) -> List[str]:
+        return self.manifest["operations"]
+
+    @property
+    def chunk_count(self) -> int:
+        return -(-len(self.manifest["frames"]) // self.manifest["chunk_frames"])
+
+    @staticmethod
+    def manifest_path(directory: Path) -> Path:
+        return Path(directory) / "manifest.json"
+
+    @classmethod
+    def load(cls, directory) -> 'Job':
+        with open(cls.manifest_path(directory)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported job manifest version in {directory}")
+        return cls(directory, manifest)
+
+    @classmethod
+    def open(cls, directory, folder, region: operations.Region, names: Sequence[str],
+             chunk_frames: int = CHUNK_FRAMES) -> 'Job':
+        directory = Path(directory)
+        folder = Path(folder).resolve()
+        if cls.manifest_path(directory).exists():
+            job = cls.load(directory)
+            if job.folder != folder or job.region != tuple(region) or job.names != list(names):
+                raise ValueError(f"{directory} belongs to a job with different frames, region or operations")
+            return job
+
+        # The frame list is fixed when the job is created, so chunks keep their frames across reruns.
+        frames = [frame.relative_to(folder).as_posix() for frame in operations.list_frames(folder)]
+        if len(frames) == 0:
+            raise ValueError(f"No frames found in {folder}")
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "folder": str(folder),
+            "region": [int(v) for v in region],
+            "operations": list(names),
+            "chunk_frames": chunk_frames,
+            "frames": frames,
+        }
+        (directory / "chunks").mkdir(parents=True, exist_ok=True)
+        temp_path = cls.manifest_path(directory).with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+        temp_path.replace(cls.manifest_path(directory))
+        return cls(directory, manifest)
+
+    def chunk_frames(self, chunk: int) -> List[Path]:
+        size = self.manifest["chunk_frames"]
+        return [self.folder / name for name in self.manifest["frames"][chunk * size:(chunk + 1) * size]]
+
+    def chunk_path(self, chunk: int) -> Path:
+        return self.directory / "chunks" / f"{chunk:06d}.npz"
+
+    def lock_path(self, chunk: int) -> Path:
+        return self.directory / "chunks" / f"{chunk:06d}.lock"
+
+    def load_state(self, chunk: int) -> ChunkState:
+        path = self.chunk_path(chunk)
+        if not path.exists():
+            return ChunkState(self.region, self.names)
+        return ChunkState.load(path, self.region, self.names)
+
+    def frames_done(self, chunk: int) -> int:
+        path = self.chunk_path(chunk)
+        if not path.exists():
+            return 0
+        with np.load(path) as arrays:
+            return int(arrays["done"])
+
+    def failed_frames(self, chunk: int) -> List[str]:
+        path = self.chunk_path(chunk)
+        if not path.exists():
+            return []
+        with np.load(path) as arrays:
+            return arrays["failed"].tolist() if "failed" in arrays else []
+
+    def is_complete(self, chunk: int) -> bool:
+        return self.frames_done(chunk) >= len(self.chunk_frames(chunk))
+
+    def claim(self, chunk: int) -> bool:
+        # Lock files are created exclusively, so every chunk is worked on by one process at a time.
+        try:
+            fd = os.open(self.lock_path(chunk), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(lock_owner())
+        return True
+
+    def release(self, chunk: int):
+        try:
+            os.remove(self.lock_path(chunk))
+        except FileNotFoundError:
+            pass
+
+    def clear_stale_locks(self, force: bool = False):
+        # Locks of processes that are gone are left behind by killed runs.
+        if os.name != "posix" and not force:
+            return
+        for path in (self.directory / "chunks").glob("*.lock"):
+            try:
+                if force or is_stale_lock(path.read_text()):
+                    path.unlink()
+            except (ValueError, FileNotFoundError):
+                pass
+
+    def process_chunk(self, chunk: int, checkpoint_seconds: float = CHECKPOINT_SECONDS) -> int:
+        frames = self.chunk_frames(chunk)
+        state = self.load_state(chunk)
+        start = state.done
+        last_checkpoint = time.monotonic()
+        try:
+            with span("chunk", chunk=chunk):
+                for frame in frames[state.done:]:
+                    try:
+                        image = operations.open_frame(frame)
+                    except Exception as e:
+                        # Recorded in the checkpoint and skipped, so reruns do not stop at the same frame.
+                        print("Could not read", frame, e)
+                        state.skip(frame.relative_to(self.folder).as_posix())
+                    else:
+                        state.add_image(image)
+                    if time.monotonic() - last_checkpoint >= checkpoint_seconds:
+                        state.save(self.chunk_path(chunk))
+                        last_checkpoint = time.monotonic()
+        finally:
+            if state.done > start:
+                state.save(self.chunk_path(chunk))
+        print(f"Chunk {chunk + 1}/{self.chunk_count} done ({len(frames)} frames)")
+        return state.done - start
+
+    def status(self) -> Dict:
+        done = sum(self.frames_done(chunk) for chunk in range(self.chunk_count))
+        complete = sum(1 for chunk in range(self.chunk_count) if self.is_complete(chunk))
+        failed = [name for chunk in range(self.chunk_count) for name in self.failed_frames(chunk)]
+        return {"frames": len(self.manifest["frames"]), "frames_done": done, "chunks": self.chunk_count,
+                "chunks_done": complete, "frames_failed": len(failed), "failed": failed}
+
+    def is_finished(self) -> bool:
+        return all(self.is_complete(chunk) for chunk in range(self.chunk_count))
+
+    def merge(self) -> ChunkState:
+        total = ChunkState(self.region, self.names)
+        with span("merge"):
+            for chunk in range(self.chunk_count):
+                total.merge(self.load_state(chunk))
+        return total
+
+    def write_results(self) -> List[Path]:
+        total = self.merge()
+        written = []
+        if total.failed:
+            print(f"Skipped {len(total.failed)} frames that could not be read:", ", ".join(total.failed))
+        if total.transparent is not None and total.transparent.reference is None:
+            print("No frames could be read")
+        elif total.transparent is not None:
+            for name, image in (("transparent", total.transparent.transparent()),
+                                ("transparent_black", total.transparent.transparent_black())):
+                path = self.directory / f"{name}.png"
+                image.save(path)
+                written.append(path)
+        if total.unique is not None:
+            unique_colors = total.unique.unique_colors()
+            if len(unique_colors) == 0:
+                print("No unique colors found")
+            else:
+                path = self.directory / "unique.png"
+                PILImage.fromarray(np.array([unique_colors], dtype=np.uint8), "RGB").save(path)
+                written.append(path)
+        return written
+
+
+def work(directory, checkpoint_seconds: float = CHECKPOINT_SECONDS) -> int:
+    job = Job.load(directory)
+    processed = 0
+    for chunk in range(job.chunk_count):
+        if job.is_complete(chunk) or not job.claim(chunk):
+            continue
+        try:
+            # Another worker may have finished it between the check and the claim.
+            if not job.is_complete(chunk):
+                processed += job.process_chunk(chunk, checkpoint_seconds)
+        finally:
+            job.release(chunk)
+    return processed
+
+
+def run_job(job: Job, workers: int = 1, checkpoint_seconds: float = CHECKPOINT_SECONDS,
+            force_unlock: bool = False) -> bool:
+    job.clear_stale_locks(force_unlock)
+    if workers <= 1:
+        work(job.directory, checkpoint_seconds)
+    else:
+        processes = [multiprocessing.Process(target=work, args=(str(job.directory), checkpoint_seconds))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    if not job.is_finished():
+        status = job.status()
+        print(f"{status['chunks_done']} of {status['chunks']} chunks complete, run again to resume")
+        return False
+    for path in job.write_results():
+        print("File written to:", path)
+    return True
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m editor.jobs",
+                                     description="Runs spritex operations over a frame folder as a resumable job.")
+    parser.add_argument("folder", help="folder of frames, searched recursively for .png files")
+    parser.add_argument("--region", type=parse_region, required=True, help="y1,x1,y2,x2")
+    parser.add_argument("--operations", default="transparent,unique", help="comma separated: transparent, unique")
+    parser.add_argument("--job", help="job directory with the manifest and checkpoints, <folder>_job by default")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the job")
+    parser.add_argument("--chunk-frames", type=int, default=CHUNK_FRAMES, help="frames per unit of work")
+    parser.add_argument("--checkpoint-seconds", type=float, default=CHECKPOINT_SECONDS,
+                        help="how often running chunks are checkpointed")
+    parser.add_argument("--status", action="store_true", help="only print the progress of the job")
+    parser.add_argument("--force-unlock", action="store_true",
+                        help="remove all chunk locks first, only when no other run of the job is active")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.operations.split(",") if name.strip()]
+    for name in names:
+        if name not in OPERATIONS:
+            parser.error(f"unknown operation: {name}")
+    folder = Path(args.folder)
+    directory = Path(args.job) if args.job else folder.parent / f"{folder.resolve().name}_job"
+
+    try:
+        job = Job.open(directory, folder, args.region, names, args.chunk_frames)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.status:
+        print(json.dumps(job.status()))
+        return 0
+    return 0 if run_job(job, args.workers, args.checkpoint_seconds, args.force_unlock) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+from editor.trace import span
+
+Region = Tuple[float, float, float, float]
+
+BAND_ROWS = 256
+# Frames are local files, sheets of several hundred megapixels are expected. PIL warns above this many pixels
+# and refuses images with twice as many as decompression bombs.
+MAX_IMAGE_PIXELS = 512 * 1024 * 1024
+PILImage.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+# Up to this many pixels unique colors are found by sorting, the 1 << 24 color bitsets only pay off above it.
+SPARSE_PIXELS = 1 << 20
+
+
+class NullProgress:
+    value = 0.0
+
+    def update(self, value):
+        self.value = value
+
+    def step(self, value):
+        pass
+
+    def partial_step(self, done, total, final):
+        pass
+
+
+NULL_PROGRESS = NullProgress()
+
+
+def list_frames(folder, directories: Optional[Dict[str, int]] = None) -> List[Path]:
+    frames = []
+    for root, dirs, files in os.walk(folder):
+        if directories is not None:
+            # Modification time of every directory listed, they change when frames are added or removed.
+            directories[root] = os.stat(root).st_mtime_ns
+        for file in files:
+            if file.endswith(".png"):
+                frames.append(Path(root) / file)
+    frames.sort()
+    return frames
+
+
+def crop(image: PILImage, region: Region) -> PILImage:
+    with span("crop"):
+        return image.crop(region)
+
+
+def open_frame(path) -> PILImage:
+    with span("decode"):
+        image = PILImage.open(path)
+        image.load()
+        return image
+
+
+def has_alpha(image: PILImage) -> bool:
+    return "A" in image.getbands() or "transparency" in image.info
+
+
+def to_pixels(image: PILImage) -> np.ndarray:
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    # RGBA because PIL keeps RGB as 4 bytes per pixel anyway and only shares RGBA buffers. The array is a
+    # read-only view of immutable bytes, which also go to texture uploads without another copy.
+    data = image.tobytes()
+    return np.frombuffer(data, dtype=np.uint8).reshape(image.size[1], image.size[0], 4)
+
+
+def pixels_to_image(pixels: np.ndarray) -> PILImage:
+    # The image shares memory with pixels, nothing is copied.
+    return PILImage.frombuffer("RGBA", (pixels.shape[1], pixels.shape[0]), pixels, "raw", "RGBA", 0, 1)
+
+
+def as_pixels(image) -> np.ndarray:
+    if isinstance(image, np.ndarray):
+        return image
+    with span("convert"):
+        return to_pixels(image)
+
+
+def region_bounds(region: Region, size: Optional[Tuple[int, int]] = None) -> Tuple[int, int, int, int]:
+    x1, y1, x2, y2 = (int(round(v)) for v in region)
+    if size is not None:
+        # Selections moved past the edges would wrap around or come out empty as numpy slices.
+        width, height = size
+        x1, x2 = min(max(x1, 0), width), min(max(x2, 0), width)
+        y1, y2 = min(max(y1, 0), height), min(max(y2, 0), height)
+    return x1, y1, x2, y2
+
+
+def pixels_size(pixels: np.ndarray) -> Tuple[int, int]:
+    return pixels.shape[1], pixels.shape[0]
+
+
+def crop_pixels(pixels: np.ndarray, region: Region) -> np.ndarray:
+    x1, y1, x2, y2 = region_bounds(region, pixels_size(pixels))
+    return pixels[y1:y2, x1:x2]
+
+
+def pad_to_region(image: Optional[PILImage], region: Region, size: Tuple[int, int]) -> Optional[PILImage]:
+    # Like PIL's crop, parts of the region outside of the image come out transparent.
+    bounds = region_bounds(region)
+    clamped = region_bounds(region, size)
+    if image is None or bounds == clamped:
+        return image
+    x1, y1, x2, y2 = bounds
+    result = PILImage.new("RGBA", (x2 - x1, y2 - y1))
+    result.paste(image, (clamped[0] - x1, clamped[1] - y1))
+    return result
+
+
+def pack_colors(pixels: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    if out is None:
+        out = np.empty(pixels.shape[:2], dtype=np.uint32)
+    np.copyto(out, pixels[..., 0])
+    np.left_shift(out, 8, out=out)
+    np.bitwise_or(out, pixels[..., 1], out=out)
+    np.left_shift(out, 8, out=out)
+    np.bitwise_or(out, pixels[..., 2], out=out)
+    return out
+
+
+def codes_to_colors(codes: np.ndarray) -> List[List[int]]:
+    return np.stack([(codes >> 16) & 0xFF, (codes >> 8) & 0xFF, codes & 0xFF], axis=1).tolist()
+
+
+def unique_codes(pixels: np.ndarray, region: Region) -> np.ndarray:
+    # Sorted packed colors of the region that do not appear anywhere outside of it.
+    x1, y1, x2, y2 = region_bounds(region, pixels_size(pixels))
+    inside = np.unique(pack_colors(pixels[y1:y2, x1:x2]))
+    outside = [pack_colors(section).reshape(-1)
+               for section in (pixels[:y1], pixels[y2:], pixels[y1:y2, :x1], pixels[y1:y2, x2:])]
+    return np.setdiff1d(inside, np.unique(np.concatenate(outside)), assume_unique=True)
+
+
+def highlight_mask(section: np.ndarray, mask: np.ndarray) -> PILImage:
+    result = np.zeros(section.shape[:2] + (4,), dtype=np.uint8)
+    result[..., :3][mask] = section[..., :3][mask]
+    result[..., 3][mask] = 255
+    return PILImage.fromarray(result, "RGBA")
+
+
+def is_sparse(pixels: np.ndarray) -> bool:
+    return pixels.shape[0] * pixels.shape[1] <= SPARSE_PIXELS
+
+
+def find_unique_colors(image, region: Region, progress=NULL_PROGRESS) -> List[List[int]]:
+    pixels = as_pixels(image)
+    progress.update(0.1)
+    if is_sparse(pixels):
+        with span("color analysis"):
+            unique_colors = codes_to_colors(unique_codes(pixels, region)[::-1])
+    else:
+        accumulator = UniqueColorAccumulator(region)
+        accumulator.add(pixels)
+        progress.update(90)
+        unique_colors = accumulator.unique_colors()
+
+    if len(unique_colors) == 0:
+        print("No unique colors found")
+        progress.update(100)
+        return []
+
+    progress.update(100)
+    return unique_colors
+
+
+def highlight_unique(image, region: Region, progress=NULL_PROGRESS) -> Optional[PILImage]:
+    pixels = as_pixels(image)
+    progress.update(0.1)
+    section = crop_pixels(pixels, region)
+    if is_sparse(pixels):
+        with span("color analysis"):
+            codes = unique_codes(pixels, region)
+            result_image = highlight_mask(section, np.isin(pack_colors(section), codes)) if len(codes) > 0 else None
+    else:
+        accumulator = UniqueColorAccumulator(region)
+        accumulator.add(pixels)
+        progress.update(90)
+        result_image = accumulator.highlight(section)
+    progress.update(100)
+    return pad_to_region(result_image, region, pixels_size(pixels))
+
+
+class TransparentAccumulator:
+    def __init__(self, region: Region):
+        self.region = region
+        self.reference: Optional[np.ndarray] = None
+        self.mask: Optional[np.ndarray] = None
+        self.frames = 0
+        self._agree: Optional[np.ndarray] = None
+
+    @staticmethod
+    def _pixel_codes(section: np.ndarray) -> Optional[np.ndarray]:
+        # RGBA pixels are compared as one uint32 each, reducing over the channel axis is many times slower.
+        if section.ndim == 3 and section.shape[2] == 4 and section.dtype == np.uint8 and \
+                section.strides[1] == 4 and section.strides[2] == 1:
+            return section.view(np.uint32)[..., 0]
+        return None
+
+    def add(self, section: np.ndarray):
+        # Sections may be views into reused buffers, only the first one is copied.
+        with span("color analysis"):
+            if self.reference is None:
+                self.reference = np.array(section, copy=True)
+                self.mask = np.ones(section.shape[:2], dtype=bool)
+            else:
+                if self._agree is None:
+                    self._agree = np.empty(section.shape[:2], dtype=bool)
+                codes = self._pixel_codes(section)
+                reference_codes = self._pixel_codes(self.reference)
+                if codes is not None and reference_codes is not None:
+                    np.equal(codes, reference_codes, out=self._agree)
+                    np.logical_and(self.mask, self._agree, out=self.mask)
+                elif section.ndim == 3:
+                    for channel in range(section.shape[2]):
+                        np.equal(section[..., channel], self.reference[..., channel], out=self._agree)
+                        np.logical_and(self.mask, self._agree, out=self.mask)
+                else:
+                    np.equal(section, self.reference, out=self._agree)
+                    np.logical_and(self.mask, self._agree, out=self.mask)
+        self.frames += 1
+
+    def add_image(self, image: PILImage):
+        section = crop(image, self.region)
+        with span("convert"):
+            self.add(np.asarray(section if section.mode == "RGBA" else section.convert("RGBA")))
+
+    def add_frame(self, path):
+        self.add_image(open_frame(path))
+
+    def merge(self, other: 'TransparentAccumulator'):
+        # Pixels agree over both frame sets when they agree within each and the two references match.
+        if other.reference is None:
+            return
+        if self.reference is None:
+            self.reference = other.reference.copy()
+            self.mask = other.mask.copy()
+        else:
+            agree = self.reference == other.reference
+            if agree.ndim == 3:
+                agree = agree.all(axis=2)
+            self.mask &= other.mask & agree
+        self.frames += other.frames
+
+    def transparent(self) -> PILImage:
+        with span("convert"):
+            if self.reference.shape[2] == 4:
+                result = self.reference.copy()
+            else:
+                result = np.dstack([self.reference, np.full(self.reference.shape[:2], 255, dtype=np.uint8)])
+            result[..., 3][~self.mask] = 0
+            return PILImage.fromarray(result, "RGBA")
+
+    def transparent_black(self) -> PILImage:
+        with span("convert"):
+            result = self.reference[..., :3].copy()
+            result[~self.mask] = 0
+            return PILImage.fromarray(result, "RGB")
+
+
+class UniqueColorAccumulator:
+    def __init__(self, region: Region):
+        self.region = region_bounds(region)
+        # One flag per 24 bit color, for colors seen inside and outside of the region.
+        self.inside = np.zeros(1 << 24, dtype=bool)
+        self.outside = np.zeros(1 << 24, dtype=bool)
+        self.frames = 0
+        self._packed: Optional[np.ndarray] = None
+
+    def _mark(self, flags: np.ndarray, pixels: np.ndarray):
+        # Colors are packed a band of rows at a time, so no frame sized temporaries are needed.
+        rows, columns = pixels.shape[:2]
+        if rows == 0 or columns == 0:
+            return
+        if self._packed is None or self._packed.shape[1] < columns:
+            self._packed = np.empty((BAND_ROWS, columns), dtype=np.uint32)
+        for start in range(0, rows, BAND_ROWS):
+            band = pixels[start:start + BAND_ROWS]
+            flags[pack_colors(band, self._packed[:band.shape[0], :columns])] = True
+
+    def add(self, pixels: np.ndarray):
+        with span("color analysis"):
+            x1, y1, x2, y2 = region_bounds(self.region, pixels_size(pixels))
+            self._mark(self.inside, pixels[y1:y2, x1:x2])
+            self._mark(self.outside, pixels[:y1])
+            self._mark(self.outside, pixels[y2:])
+            self._mark(self.outside, pixels[y1:y2, :x1])
+            self._mark(self.outside, pixels[y1:y2, x2:])
+        self.frames += 1
+
+    def add_image(self, image: PILImage):
+        self.add(as_pixels(image))
+
+    def merge(self, other: 'UniqueColorAccumulator'):
+        self.inside |= other.inside
+        self.outside |= other.outside
+        self.frames += other.frames
+
+    def unique_flags(self) -> np.ndarray:
+        # inside and not outside, in one pass and without temporaries.
+        return np.greater(self.inside, self.outside)
+
+    def unique_colors(self) -> List[List[int]]:
+        with span("color analysis"):
+            return codes_to_colors(np.flatnonzero(self.unique_flags())[::-1])
+
+    def highlight(self, section: np.ndarray) -> Optional[PILImage]:
+        with span("color analysis"):
+            flags = self.unique_flags()
+            if not flags.any():
+                return None
+            return highlight_mask(section, flags[pack_colors(section)])
+
+
+def accumulate_transparent(frames: Sequence[Path], region: Region, progress=NULL_PROGRESS) -> TransparentAccumulator:
+    progress.update(0.1)
+    accumulator = TransparentAccumulator(region)
+    for frame in frames:
+        accumulator.add_frame(frame)
+        progress.partial_step(1, len(frames), 99)
+    progress.update(100)
+    return accumulator
+
+
+def extract_transparent_black(frames: Sequence[Path], region: Region, progress=NULL_PROGRESS) -> PILImage:
+    return accumulate_transparent(frames, region, progress).transparent_black()
+
+
+def extract_transparent(frames: Sequence[Path], region: Region) -> PILImage:
+    return accumulate_transparent(frames, region).transparent()
@@ -0,0 +1,262 @@
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image as PILImage
+
+from editor import operations
+from editor.trace import span
+
+# Indices are stored as uint16 at most and the opaque color table keeps entry + 1, frames with more colors than
+# this can not be indexed.
+MAX_COLORS = (1 << 16) - 1
+
+# A released opaque color table is kept for the next palette, clearing the entries of one palette is much
+# cheaper than the OS zeroing 32 MB again.
+_spare_tables: List[np.ndarray] = []
+
+
+class TooManyColors(ValueError):
+    pass
+
+
+def pack_rgba(pixels: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    # Alpha goes to the top byte, so code & 0xFFFFFF is the same packed RGB used by the color bitsets.
+    out = operations.pack_colors(pixels, out)
+    if pixels.shape[2] == 4:
+        np.bitwise_or(out, np.left_shift(pixels[..., 3], 24, dtype=np.uint32), out=out)
+    else:
+        np.bitwise_or(out, np.uint32(0xFF000000), out=out)
+    return out
+
+
+class Palette:
+    def __init__(self, max_colors: int = MAX_COLORS):
+        self.max_colors = max_colors
+        # Packed RGBA of every entry, in the order the colors were first seen. Entries are never removed,
+        # so indices of frames indexed earlier stay valid as the palette grows.
+        self.codes = np.empty(0, dtype=np.uint32)
+        self._sorted = np.empty(0, dtype=np.uint32)
+        self._entries = np.empty(0, dtype=np.uint16)
+        # Entry + 1 of every opaque color by packed RGB, 0 for colors not in the palette yet. Only the pages
+        # holding palette colors are ever written, so it takes a few KB per color, not 32 MB.
+        self._opaque: Optional[np.ndarray] = None
+        self._packed: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def dtype(self):
+        return np.uint8 if len(self.codes) <= 256 else np.uint16
+
+    @property
+    def colors(self) -> np.ndarray:
+        codes = self.codes
+        return np.stack([(codes >> 16) & 0xFF, (codes >> 8) & 0xFF, codes & 0xFF, codes >> 24],
+                        axis=1).astype(np.uint8)
+
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.codes & 0xFFFFFF
+
+    def _bands(self, pixels: np.ndarray):
+        rows, columns = pixels.shape[:2]
+        if self._packed is None or self._packed.shape[1] < columns:
+            self._packed = np.empty((operations.BAND_ROWS, columns), dtype=np.uint32)
+        for start in range(0, rows, operations.BAND_ROWS):
+            band = pixels[start:start + operations.BAND_ROWS]
+            yield start, pack_rgba(band, self._packed[:band.shape[0], :columns])
+
+    def add_codes(self, codes: np.ndarray):
+        new = np.setdiff1d(codes, self._sorted)
+        if len(new) == 0:
+            return
+        if len(self.codes) + len(new) > self.max_colors:
+            raise TooManyColors(f"Too many colors for indexed mode: more than {self.max_colors}")
+        entries = np.arange(len(self.codes), len(self.codes) + len(new), dtype=np.uint16)
+        self.codes = np.concatenate([self.codes, new])
+        order = np.argsort(np.concatenate([self._sorted, new]), kind="stable")
+        self._sorted = np.concatenate([self._sorted, new])[order]
+        self._entries = np.concatenate([self._entries, entries])[order]
+        if self._opaque is not None:
+            opaque = (new >> 24) == 0xFF
+            self._opaque[new[opaque] & 0xFFFFFF] = entries[opaque] + 1
+
+    def release(self):
+        # Gives the opaque color table back, it is rebuilt when more opaque pixels are indexed.
+        if self._opaque is None:
+            return
+        self._opaque[self.codes & 0xFFFFFF] = 0
+        if len(_spare_tables) == 0:
+            _spare_tables.append(self._opaque)
+        self._opaque = None
+
+    def lookup(self, codes: np.ndarray) -> np.ndarray:
+        return self._entries[np.searchsorted(self._sorted, codes)]
+
+    def _index_opaque(self, pixels: np.ndarray) -> np.ndarray:
+        # Opaque pixels are looked up in the color table, only colors missing from the palette are sorted.
+        if self._opaque is None:
+            try:
+                self._opaque = _spare_tables.pop()
+            except IndexError:
+                self._opaque = np.zeros(1 << 24, dtype=np.uint16)
+            opaque = (self.codes >> 24) == 0xFF
+            self._opaque[self.codes[opaque] & 0xFFFFFF] = np.flatnonzero(opaque) + 1
+        entries = np.empty(pixels.shape[:2], dtype=np.uint16)
+        rows, columns = pixels.shape[:2]
+        if self._packed is None or self._packed.shape[1] < columns:
+            self._packed = np.empty((operations.BAND_ROWS, columns), dtype=np.uint32)
+        for start in range(0, rows, operations.BAND_ROWS):
+            band = pixels[start:start + operations.BAND_ROWS]
+            packed = operations.pack_colors(band, self._packed[:band.shape[0], :columns])
+            found = self._opaque[packed]
+            missing = found == 0
+            if missing.any():
+                self.add_codes(np.unique(packed[missing]) | np.uint32(0xFF000000))
+                found = self._opaque[packed]
+            np.subtract(found, 1, out=entries[start:start + band.shape[0]])
+        # The index type depends on the final palette size.
+        return entries if self.dtype == np.uint16 else entries.astype(self.dtype)
+
+    def index(self, pixels: np.ndarray) -> np.ndarray:
+        with span("index colors"):
+            if pixels.shape[0] == 0 or pixels.shape[1] == 0:
+                return np.zeros(pixels.shape[:2], dtype=self.dtype)
+            if pixels.shape[2] == 3 or pixels[..., 3].min() == 0xFF:
+                return self._index_opaque(pixels)
+            # Colors are collected first, the index type depends on the final palette size.
+            self.add_codes(np.unique(np.concatenate([np.unique(packed) for start, packed in self._bands(pixels)])))
+            indices = np.empty(pixels.shape[:2], dtype=self.dtype)
+            for start, packed in self._bands(pixels):
+                indices[start:start + packed.shape[0]] = self.lookup(packed)
+            return indices
+
+    def index_image(self, image: PILImage) -> np.ndarray:
+        if image.mode in ("RGB", "RGBA"):
+            return self.index(np.asarray(image))
+        if image.mode != "P":
+            return self.index(operations.as_pixels(image))
+        # Palette images are remapped through their own palette, no pixel has to be converted.
+        with span("index colors"):
+            colors = np.zeros((256, 4), dtype=np.uint8)
+            colors[:, 3] = 255
+            palette = np.array(image.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)[:256]
+            colors[:len(palette), :3] = palette
+            transparency = image.info.get("transparency")
+            if isinstance(transparency, int):
+                colors[transparency, 3] = 0
+            elif isinstance(transparency, bytes):
+                colors[:len(transparency), 3] = np.frombuffer(transparency, dtype=np.uint8)[:256]
+            codes = pack_rgba(colors[np.newaxis])[0]
+            used = np.zeros(256, dtype=bool)
+            file_indices = np.asarray(image)
+            used[file_indices] = True
+            self.add_codes(np.unique(codes[used]))
+            lut = np.zeros(256, dtype=self.dtype)
+            lut[used] = self.lookup(codes[used])
+            return lut[file_indices]
+
+    def to_pixels(self, indices: np.ndarray) -> np.ndarray:
+        return self.colors[indices]
+
+    def to_image(self, indices: np.ndarray) -> PILImage:
+        return PILImage.fromarray(self.to_pixels(indices), "RGBA")
+
+
+class IndexedFrame:
+    def __init__(self, indices: np.ndarray, palette: Palette):
+        self.indices = indices
+        self.palette = palette
+
+    @property
+    def nbytes(self) -> int:
+        return self.indices.nbytes + self.palette.codes.nbytes
+
+
+def index_frame(image, palette: Optional[Palette] = None) -> IndexedFrame:
+    palette = palette if palette is not None else Palette()
+    if isinstance(image, np.ndarray):
+        frame = IndexedFrame(palette.index(image), palette)
+    else:
+        frame = IndexedFrame(palette.index_image(image), palette)
+    # Kept frames only need the palette entries.
+    palette.release()
+    return frame
+
+
+class IndexedUniqueColorAccumulator:
+    def __init__(self, region: operations.Region, palette: Optional[Palette] = None):
+        self.region = operations.region_bounds(region)
+        self.palette = palette if palette is not None else Palette()
+        # One flag per palette entry instead of the 1 << 24 color bitsets, grown along with the palette.
+        self.inside = np.zeros(0, dtype=bool)
+        self.outside = np.zeros(0, dtype=bool)
+        self.frames = 0
+
+    def _grow(self):
+        count = len(self.palette)
+        if len(self.inside) < count:
+            self.inside = np.concatenate([self.inside, np.zeros(count - len(self.inside), dtype=bool)])
+            self.outside = np.concatenate([self.outside, np.zeros(count - len(self.outside), dtype=bool)])
+
+    def add_indices(self, indices: np.ndarray):
+        with span("color analysis"):
+            self._grow()
+            x1, y1, x2, y2 = operations.region_bounds(self.region, operations.pixels_size(indices))
+            self.inside[indices[y1:y2, x1:x2]] = True
+            for section in (indices[:y1], indices[y2:], indices[y1:y2, :x1], indices[y1:y2, x2:]):
+                self.outside[section] = True
+        self.frames += 1
+
+    def add(self, pixels: np.ndarray):
+        self.add_indices(self.palette.index(pixels))
+
+    def add_image(self, image: PILImage):
+        self.add_indices(self.palette.index_image(image))
+
+    def unique_rgb(self) -> np.ndarray:
+        # Entries differing only in alpha are the same color, like in the RGB bitsets.
+        rgb = self.palette.rgb[:len(self.inside)]
+        return np.setdiff1d(rgb[self.inside], rgb[self.outside])
+
+    def unique_flags(self) -> np.ndarray:
+        return np.isin(self.palette.rgb[:len(self.inside)], self.unique_rgb())
+
+    def unique_colors(self) -> List[List[int]]:
+        with span("color analysis"):
+            return operations.codes_to_colors(self.unique_rgb()[::-1])
+
+    def highlight_indices(self, section: np.ndarray) -> Optional[PILImage]:
+        with span("color analysis"):
+            unique = self.unique_flags()
+            if not unique.any():
+                return None
+            lut = np.zeros((len(unique), 4), dtype=np.uint8)
+            lut[unique, :3] = self.palette.colors[:len(unique)][unique, :3]
+            lut[unique, 3] = 255
+            return PILImage.fromarray(lut[section], "RGBA")
+
+
+def find_unique_colors(frame: IndexedFrame, region: operations.Region,
+                       progress=operations.NULL_PROGRESS) -> List[List[int]]:
+    progress.update(0.1)
+    accumulator = IndexedUniqueColorAccumulator(region, frame.palette)
+    accumulator.add_indices(frame.indices)
+    progress.update(90)
+    unique_colors = accumulator.unique_colors()
+    if len(unique_colors) == 0:
+        print("No unique colors found")
+    progress.update(100)
+    return unique_colors
+
+
+def highlight_unique(frame: IndexedFrame, region: operations.Region,
+                     progress=operations.NULL_PROGRESS) -> Optional[PILImage]:
+    progress.update(0.1)
+    accumulator = IndexedUniqueColorAccumulator(region, frame.palette)
+    accumulator.add_indices(frame.indices)
+    progress.update(90)
+    result_image = accumulator.highlight_indices(operations.crop_pixels(frame.indices, region))
+    progress.update(100)
+    return operations.pad_to_region(result_image, region, operations.pixels_size(frame.indices))
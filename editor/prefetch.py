@@ -0,0 +1,164 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+from PIL import Image as PILImage
+
+from editor import operations
+from editor.cache import CACHE_DIRECTORY, DISK_CACHE_BYTES, trim_directory
+from editor.trace import span
+
+# Images above this many pixels are shown as a reduced preview first and loaded in background.
+PREVIEW_THRESHOLD = 4096 * 4096
+PREVIEW_SIZE = 2048
+THUMBNAIL_CACHE = CACHE_DIRECTORY / "thumbnails"
+
+
+class PreparedFrame:
+    def __init__(self, path: Path, pixels: np.ndarray, has_alpha: bool = True):
+        self.path = path
+        # The canonical RGBA buffer, image is a view of it for PIL based code.
+        self.pixels = pixels
+        self.image = operations.pixels_to_image(pixels)
+        self.has_alpha = has_alpha
+        # Palette indices of the frame, made on first use in indexed color mode.
+        self.indexed = None
+        # Filled in on the main thread, GL calls can not be made from the prefetch workers.
+        self.texture = None
+
+
+def needs_preview(size) -> bool:
+    return size[0] * size[1] > PREVIEW_THRESHOLD
+
+
+def preview_factor(size) -> int:
+    return max(1, -(-max(size) // PREVIEW_SIZE))
+
+
+def thumbnail_path(path: Path) -> Path:
+    stat = os.stat(path)
+    key = f"{Path(path).resolve()}:{stat.st_mtime_ns}:{stat.st_size}"
+    return THUMBNAIL_CACHE / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.png"
+
+
+def save_thumbnail(path: Path, image: PILImage):
+    target = thumbnail_path(path)
+    if target.exists():
+        return
+    with span("thumbnail"):
+        source = image if image.mode in ("L", "RGB", "RGBA") else image.convert("RGB")
+        thumbnail = source.reduce(preview_factor(image.size))
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = target.with_name(f"{target.stem}.{threading.get_ident()}.tmp")
+            thumbnail.save(temp_path, "png")
+            temp_path.replace(target)
+            trim_directory(THUMBNAIL_CACHE, DISK_CACHE_BYTES, ".png")
+        except OSError as e:
+            print("Could not cache thumbnail:", e)
+
+
+def load_preview(path: Path) -> Optional[PILImage]:
+    cached = thumbnail_path(path)
+    if cached.exists():
+        cached.touch()
+        return operations.open_frame(cached)
+
+    with PILImage.open(path) as image:
+        if image.format != "JPEG":
+            # Other formats can not be decoded at reduced size, the preview is cached once the full image is loaded.
+            return None
+        factor = preview_factor(image.size)
+        image.draft("RGB", (image.size[0] // factor, image.size[1] // factor))
+        with span("decode"):
+            image.load()
+        return image.copy()
+
+
+def prepare_frame(path: Path) -> PreparedFrame:
+    image = operations.open_frame(path)
+    if needs_preview(image.size):
+        save_thumbnail(path, image)
+    with span("convert"):
+        pixels = operations.to_pixels(image)
+    return PreparedFrame(path, pixels, operations.has_alpha(image))
+
+
+class FramePrefetcher:
+    def __init__(self, prepare: Callable[[Path], PreparedFrame] = prepare_frame, size: int = 8,
+                 workers: int = 2, max_bytes: int = 512 * 1024 * 1024):
+        self.prepare = prepare
+        self.size = size
+        self.max_bytes = max_bytes
+        self.cache: 'OrderedDict[Path, Future]' = OrderedDict()
+        self.listeners = []
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+
+    def _prepare(self, path: Path) -> PreparedFrame:
+        with span("prefetch", path=str(path)):
+            return self.prepare(path)
+
+    @staticmethod
+    def _frame_bytes(future: Future) -> int:
+        if not future.done() or future.cancelled() or future.exception() is not None:
+            return 0
+        return future.result().pixels.nbytes
+
+    def _trim(self):
+        # Sizes are only known once frames are decoded, so this runs on request and on completion.
+        total = sum(self._frame_bytes(future) for future in self.cache.values())
+        while len(self.cache) > 1 and (len(self.cache) > self.size or total > self.max_bytes):
+            evicted_path, evicted = self.cache.popitem(last=False)
+            evicted.cancel()
+            total -= self._frame_bytes(evicted)
+
+    def _notify(self, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            self._trim()
+        for listener in self.listeners:
+            listener(future.result())
+
+    def request(self, path: Path) -> Future:
+        with self._lock:
+            future = self.cache.get(path)
+            if future is not None:
+                self.cache.move_to_end(path)
+                return future
+
+            future = self._executor.submit(self._prepare, path)
+            self.cache[path] = future
+            self._trim()
+        future.add_done_callback(self._notify)
+        return future
+
+    def get(self, path: Path) -> PreparedFrame:
+        future = self.request(path)
+        try:
+            return future.result()
+        except Exception:
+            with self._lock:
+                if self.cache.get(path) is future:
+                    del self.cache[path]
+            raise
+
+    def prefetch(self, paths: Iterable[Path]):
+        for path in paths:
+            self.request(path)
+
+    def clear(self):
+        with self._lock:
+            for future in self.cache.values():
+                future.cancel()
+            self.cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,144 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start", "child_time", "children")
+
+    def __init__(self, tracer: 'Tracer', name: str, args: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+        self.child_time = 0.0
+        self.children: Dict[str, float] = {}
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.tracer._pop(self, time.perf_counter())
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled: bool = False, max_events: int = 200000):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events: deque = deque(maxlen=max_events)
+        # Called with (name, duration, {span name: exclusive duration}) whenever a top level span of the main
+        # thread ends.
+        self.listeners: List[Callable[[str, float, Dict[str, float]], None]] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._totals: Dict[str, List[float]] = {}
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def traced(self, name: str):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span: Span):
+        self._stack().append(span)
+
+    def _pop(self, span: Span, end: float):
+        stack = self._stack()
+        stack.pop()
+        duration = end - span.start
+        self.events.append((span.name, span.start, duration, threading.get_ident(), span.args))
+
+        with self._lock:
+            total = self._totals.setdefault(span.name, [0, 0.0])
+            total[0] += 1
+            total[1] += duration
+
+        exclusive = duration - span.child_time
+        if stack:
+            stack[-1].child_time += duration
+            root = stack[0]
+            root.children[span.name] = root.children.get(span.name, 0.0) + exclusive
+        else:
+            if span.children:
+                span.children["other"] = exclusive
+            # Only spans of the UI thread are reported, background work would hide the last operation.
+            if threading.current_thread() is threading.main_thread():
+                for listener in self.listeners:
+                    listener(span.name, duration, span.children)
+
+    def reset(self):
+        self.events.clear()
+        with self._lock:
+            self._totals.clear()
+
+    def summary(self) -> Dict[str, Tuple[int, float]]:
+        with self._lock:
+            return {name: (int(count), total) for name, (count, total) in self._totals.items()}
+
+    def chrome_trace(self) -> Dict:
+        pid = os.getpid()
+        events = []
+        for name, start, duration, tid, args in list(self.events):
+            events.append({
+                "name": name,
+                "cat": "spritex",
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+tracer = Tracer(enabled=bool(os.environ.get("SPRITEX_TRACE")))
+span = tracer.span
+traced = tracer.traced
+
+
+def format_timings(name: str, duration: float, children: Optional[Dict[str, float]] = None) -> str:
+    lines = [f"[b]{name}[/b] {duration * 1000:.1f} ms"]
+    for child, child_duration in sorted((children or {}).items(), key=lambda item: -item[1]):
+        lines.append(f"  {child} {child_duration * 1000:.1f} ms")
+    return "\n".join(lines)
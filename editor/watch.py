@@ -0,0 +1,134 @@
+import os
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class FolderWatcher:
+    def __init__(self, folder, suffix: str = ".png"):
+        self.folder = Path(folder)
+        self.suffix = suffix
+        # Frames are found in subfolders too, like list_frames. Names are paths relative to the folder.
+        self._directories: Dict[str, int] = {}
+        self.known: Set[str] = set(self._list())
+        # Polling only: new files and their last seen size, reported once the size stops changing.
+        self.pending: Dict[str, int] = {}
+        # Files that could not be read, with their size and mtime. Reported again once either changes.
+        self.failed: Dict[str, Tuple[int, int]] = {}
+        self._inotify = None
+        # Relative folder of every inotify watch descriptor.
+        self._watches: Dict[int, str] = {}
+        if INotify is not None:
+            self._inotify = INotify()
+            for directory in self._directories:
+                self._add_watch(directory)
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if self._inotify is not None else "polling"
+
+    def _changed(self) -> bool:
+        try:
+            return any(os.stat(directory).st_mtime_ns != mtime for directory, mtime in self._directories.items())
+        except FileNotFoundError:
+            return True
+
+    def _file_state(self, name: str) -> Tuple[int, int]:
+        stat = os.stat(self.folder / name)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _walk(self, folder: Path, directories: Dict[str, int]) -> List[str]:
+        names = []
+        for root, dirs, files in os.walk(folder):
+            directories[root] = os.stat(root).st_mtime_ns
+            relative = Path(root).relative_to(self.folder)
+            names.extend((relative / file).as_posix() for file in files if file.endswith(self.suffix))
+        return names
+
+    def _list(self) -> List[str]:
+        self._directories = {}
+        return self._walk(self.folder, self._directories)
+
+    def _add_watch(self, directory: str):
+        descriptor = self._inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+        self._watches[descriptor] = Path(directory).relative_to(self.folder).as_posix()
+
+    def _poll_inotify(self) -> List[str]:
+        names = []
+        for event in self._inotify.read(timeout=0):
+            if event.wd not in self._watches:
+                continue
+            name = (Path(self._watches[event.wd]) / event.name).as_posix()
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # Frames that landed before the new folder was watched are only found by listing it.
+                    directories = {}
+                    names.extend(found for found in self._walk(self.folder / name, directories)
+                                 if found not in self.known)
+                    for directory in directories:
+                        self._add_watch(directory)
+            elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO) and name.endswith(self.suffix) and \
+                    name not in self.known:
+                names.append(name)
+        return names
+
+    def _poll_folder(self) -> List[str]:
+        # Listing the folders is skipped entirely while their mtimes are unchanged and nothing is pending.
+        if self._changed():
+            for name in self._list():
+                if name not in self.known and name not in self.pending and name not in self.failed:
+                    self.pending[name] = -1
+
+        # Rewriting a file in place does not change folder mtimes, failed files are checked one by one.
+        for name, state in list(self.failed.items()):
+            try:
+                changed = self._file_state(name) != state
+            except FileNotFoundError:
+                del self.failed[name]
+                continue
+            if changed:
+                del self.failed[name]
+                self.pending[name] = -1
+
+        names = []
+        for name, last_size in list(self.pending.items()):
+            try:
+                size = os.stat(self.folder / name).st_size
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+            if size > 0 and size == last_size:
+                del self.pending[name]
+                names.append(name)
+            else:
+                self.pending[name] = size
+        return names
+
+    def poll(self) -> List[Path]:
+        if self._inotify is not None:
+            names = self._poll_inotify()
+        else:
+            names = self._poll_folder()
+        names = sorted(set(names))
+        self.known.update(names)
+        for name in names:
+            self.failed.pop(name, None)
+        return [self.folder / name for name in names]
+
+    def retry(self, path):
+        # For files that were reported but could not be read yet, e.g. still being written.
+        name = Path(path).relative_to(self.folder).as_posix()
+        self.known.discard(name)
+        try:
+            self.failed[name] = self._file_state(name)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,98 @@
+import os
+import socket
+
+import numpy as np
+import pytest
+
+from editor import benchmark, jobs, operations
+
+OPERATIONS = ["transparent", "unique"]
+
+
+@pytest.fixture
+def frames(tmp_path):
+    paths = benchmark.generate_frame_folder(tmp_path / "frames", 96, 64, colors=16, frames=10)
+    return paths, benchmark.sprite_region(96, 64)
+
+
+def open_job(tmp_path, frames):
+    paths, region = frames
+    return jobs.Job.open(tmp_path / "job", tmp_path / "frames", region, OPERATIONS, chunk_frames=4)
+
+
+def expected_results(paths, region):
+    transparent = operations.accumulate_transparent(paths, region)
+    unique = operations.UniqueColorAccumulator(region)
+    for path in paths:
+        unique.add_image(operations.open_frame(path))
+    return transparent, unique
+
+
+def assert_same(total: jobs.ChunkState, transparent, unique):
+    assert np.array_equal(np.asarray(total.transparent.transparent()), np.asarray(transparent.transparent()))
+    assert np.array_equal(np.asarray(total.transparent.transparent_black()),
+                          np.asarray(transparent.transparent_black()))
+    assert total.unique.unique_colors() == unique.unique_colors()
+
+
+class Killed(BaseException):
+    pass
+
+
+def test_interrupted_chunk_resumes(tmp_path, frames, monkeypatch):
+    paths, region = frames
+    job = open_job(tmp_path, frames)
+    open_frame = operations.open_frame
+    opened = []
+
+    def killed_at_sixth_frame(path):
+        opened.append(path)
+        if len(opened) == 6:
+            raise Killed()
+        return open_frame(path)
+
+    monkeypatch.setattr(operations, "open_frame", killed_at_sixth_frame)
+    with pytest.raises(Killed):
+        jobs.run_job(job, checkpoint_seconds=3600)
+    # The second chunk stopped after one frame and was checkpointed on the way out.
+    assert job.is_complete(0) and job.frames_done(1) == 1 and not job.is_finished()
+    assert not job.lock_path(1).exists()
+
+    opened.clear()
+    monkeypatch.setattr(operations, "open_frame", lambda path: opened.append(path) or open_frame(path))
+    assert jobs.run_job(jobs.Job.load(job.directory))
+    assert opened == paths[5:]
+    assert_same(job.merge(), *expected_results(paths, region))
+
+
+def test_failed_frames_are_skipped(tmp_path, frames, monkeypatch):
+    paths, region = frames
+    job = open_job(tmp_path, frames)
+    open_frame = operations.open_frame
+
+    def failing(path):
+        if path == paths[2]:
+            raise ValueError("bad frame")
+        return open_frame(path)
+
+    monkeypatch.setattr(operations, "open_frame", failing)
+    assert jobs.run_job(job)
+    status = job.status()
+    assert status["frames_done"] == len(paths)
+    assert status["failed"] == [paths[2].name]
+    good = [path for path in paths if path != paths[2]]
+    assert_same(job.merge(), *expected_results(good, region))
+
+
+def test_stale_locks(tmp_path, frames):
+    job = open_job(tmp_path, frames)
+    host = socket.gethostname()
+    owners = {0: jobs.lock_owner(), 1: f"{host} {os.getpid()} 1\n", 2: "otherhost 1 1\n"}
+    for chunk, owner in owners.items():
+        job.lock_path(chunk).write_text(owner)
+    job.clear_stale_locks()
+    assert job.lock_path(0).exists()
+    assert job.lock_path(1).exists() == (jobs.process_start(os.getpid()) is None)
+    assert job.lock_path(2).exists()
+    job.clear_stale_locks(force=True)
+    assert not any(job.lock_path(chunk).exists() for chunk in owners)
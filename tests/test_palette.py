@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from editor import benchmark, operations, palette
+
+SIZES = [(64, 48, 16), (300, 200, 200), (256, 256, 600)]
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: f"{size[0]}x{size[1]}_{size[2]}")
+def frames(request, tmp_path):
+    width, height, colors = request.param
+    paths = benchmark.generate_frame_folder(tmp_path, width, height, colors=colors, frames=4)
+    return paths, benchmark.sprite_region(width, height)
+
+
+def test_index_frame_round_trip(frames):
+    paths, region = frames
+    pixels = operations.to_pixels(operations.open_frame(paths[0]))
+    indexed = palette.index_frame(pixels)
+    assert indexed.indices.dtype == (np.uint8 if len(indexed.palette) <= 256 else np.uint16)
+    assert np.array_equal(indexed.palette.to_pixels(indexed.indices), pixels)
+
+
+def test_unique_colors_match_rgb(frames):
+    paths, region = frames
+    pixels = operations.to_pixels(operations.open_frame(paths[0]))
+    indexed = palette.index_frame(pixels)
+    assert palette.find_unique_colors(indexed, region) == operations.find_unique_colors(pixels, region)
+    expected = operations.highlight_unique(pixels, region)
+    result = palette.highlight_unique(indexed, region)
+    assert (result is None) == (expected is None)
+    if expected is not None:
+        assert np.array_equal(np.asarray(result), np.asarray(expected))
+
+
+def test_translucent_pixels():
+    random = np.random.RandomState(1)
+    pixels = random.randint(0, 4, (40, 50, 4)).astype(np.uint8) * 60
+    pixels[..., 3] = random.choice([0, 128, 255], (40, 50))
+    indexed = palette.index_frame(pixels)
+    assert np.array_equal(indexed.palette.to_pixels(indexed.indices), pixels)
+    region = (10, 10, 30, 25)
+    assert palette.find_unique_colors(indexed, region) == operations.find_unique_colors(pixels, region)
+
+
+def test_palette_images():
+    image = PILImage.fromarray(np.random.RandomState(2).randint(0, 8, (30, 40, 3)).astype(np.uint8) * 30, "RGB")
+    image = image.convert("P", palette=PILImage.ADAPTIVE, colors=256)
+    image.info["transparency"] = 3
+    indexed = palette.index_frame(image)
+    assert np.array_equal(indexed.palette.to_pixels(indexed.indices), np.asarray(image.convert("RGBA")))
+
+
+def test_too_many_colors(frames):
+    paths, region = frames
+    pixels = operations.to_pixels(operations.open_frame(paths[0]))
+    colors = len(palette.index_frame(pixels).palette)
+    with pytest.raises(palette.TooManyColors):
+        palette.index_frame(pixels, palette.Palette(max_colors=colors - 1))
+
+
+@pytest.mark.parametrize("region", [(-2, 10, 20, 30), (50, -5, 80, 20), (-10, -10, 200, 200)])
+def test_regions_past_the_edges(region, monkeypatch):
+    random = np.random.RandomState(3)
+    pixels = np.ascontiguousarray(random.randint(0, 6, (40, 64, 4)).astype(np.uint8) * 40)
+    pixels[..., 3] = 255
+    clamped = operations.region_bounds(region, (64, 40))
+    pixels[clamped[1]:clamped[1] + 4, clamped[0]:clamped[0] + 4, :3] = 250
+    expected = operations.find_unique_colors(pixels, clamped)
+    indexed = palette.index_frame(pixels)
+    assert palette.find_unique_colors(indexed, region) == expected
+    x1, y1, x2, y2 = operations.region_bounds(region)
+    results = [palette.highlight_unique(indexed, region)]
+    for sparse_pixels in (1 << 20, 0):
+        monkeypatch.setattr(operations, "SPARSE_PIXELS", sparse_pixels)
+        assert operations.find_unique_colors(pixels, region) == expected
+        results.append(operations.highlight_unique(pixels, region))
+    for result in results:
+        assert result is not None and result.size == (x2 - x1, y2 - y1)
+        assert np.array_equal(np.asarray(result), np.asarray(results[0]))